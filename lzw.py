@@ -1,11 +1,25 @@
 import os
 import sys
+import io
 import argparse
 import random
+import contextlib
+import zlib
+import mmap
+import time
+from array import array
 from os.path import join, isabs, isfile, exists, isdir, basename, dirname
 
 CODE_SIZE = 12
 DICT_LIMIT = EOF = 4095 # 2**12-1
+COMPACT_BITS = 20 # *dictionaries of this many bits or more are stored in compact arrays
+CHUNK_SIZE = 2**16 # block size of buffered file I/O
+
+# *numpy is optional: the bulk code packing falls back to write_code/read_code without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 '''
     Parse command line arguments
@@ -19,6 +33,18 @@ def parse_args():
     group.add_argument('-d', dest='d', type=str, help='Input file to be decompressed')
     return parser.parse_args(), parser.print_help
 
+'''
+    *Conversion between the bit buffer (an int) and an array of bits, most significant bit first
+'''
+def int_to_bits(value, bit_count):
+    return ((value >> np.arange(bit_count-1, -1, -1, dtype=np.int64)) & 1).astype(np.uint8)
+
+def bits_to_int(bits):
+    value = 0
+    for bit in bits.tolist():
+        value = (value << 1) | bit
+    return value
+
 '''
     *Custom class for LZW_enhancement to override.
     Supposed to be an abstract class or interface, but the library 'abc' is not usable according to guidelines
@@ -42,42 +68,111 @@ class BaseLZWWriter:
     def read_file_header(self)->list:'''Read the file header and return the list of file stored in the compressed file'''
 
     def write_file_header(self, input_file_names):'''Write the file header to the compressed file containing names of the files'''
+
+    def align_output(self):'''*Pad the written bits with zeros up to the next output unit, so that raw bytes can follow'''
+
+    def align_input(self):'''*Discard the read bits up to the next input unit, so that raw bytes can follow'''
+
+    def read_bytes(self, n)->bytes:'''*Read at most n raw bytes from the input file'''
+
+    def skip_bytes(self, n):'''*Skip n raw bytes of the input file'''
+
+    def write_bytes(self, data):'''*Write raw bytes to the output file'''
+
+    '''
+        *Write an array of codes of size CODE_SIZE to the output file
+    '''
+    def write_codes(self, codes):
+        if np is not None and isinstance(codes, np.ndarray):
+            codes = codes.tolist()
+        for code in codes:
+            self.write_code(code)
+
+    '''
+        *Read at most n codes of size CODE_SIZE from the input file
+        Return fewer than n codes if the end of file is reached
+    '''
+    def read_codes(self, n):
+        codes = []
+        for _ in range(n):
+            code = self.read_code()
+            if code is None:
+                break
+            codes.append(code)
+        return codes
+
+    '''
+        *Iterate over all codes in the input file, reading them in batches of n codes
+    '''
+    def iter_codes(self, n=CHUNK_SIZE):
+        while True:
+            codes = self.read_codes(n)
+            if len(codes) == 0:
+                return
+            if np is not None and isinstance(codes, np.ndarray):
+                codes = codes.tolist()
+            yield from codes
     
 class LZWWriter(BaseLZWWriter):
+    UNIT_BITS = 8 # number of bits per output unit; the block buffers hold one unit per byte
+
     def __init__(self, file, code_size=CODE_SIZE):
         self.file = file
-        self.name = file.name
+        self.name = file_name(file)
         self.code_size = code_size
 
+        # bit buffer shared by read_code() and write_code()
+        self.buffer = 0
+        self.buffer_bit_count = 0
+
+        # *block buffers, so that the file is only touched once per CHUNK_SIZE bytes
+        self.in_chunk = b''
+        self.in_pos = 0
+        self.out_chunk = bytearray()
+
     '''
         Reset internal state
     '''
     def initialize(self):
         pass
 
+    '''
+        *Refill the input block buffer from the file
+        Return False if the end of file is reached
+    '''
+    def fill_input(self):
+        self.in_chunk = self.file.read(CHUNK_SIZE)
+        self.in_pos = 0
+        return len(self.in_chunk) > 0
+
+    '''
+        *Write out everything in the output block buffer to the file
+    '''
+    def flush_output(self):
+        if self.out_chunk:
+            self.file.write(self.out_chunk)
+            self.out_chunk = bytearray()
+
     '''
         Read a code of size CODE_SIZE from the input file
         Return None if the end of file is reached
     '''
     def read_code(self):
-        read_code = self
-        input_file = self.file
+        code_size = self.code_size
+        buffer, buffer_bit_count = self.buffer, self.buffer_bit_count
 
-        # skeleton code:
-        if not hasattr(read_code, 'buffer'):
-            read_code.buffer = 0
-            read_code.buffer_bit_count = 0
-        while read_code.buffer_bit_count < self.code_size:
-            input_byte = input_file.read(1)
-            if input_byte == b'':
+        while buffer_bit_count < code_size:
+            if self.in_pos >= len(self.in_chunk) and not self.fill_input():
+                self.buffer, self.buffer_bit_count = buffer, buffer_bit_count
                 return None
-            read_code.buffer <<= 8
-            read_code.buffer |= int.from_bytes(input_byte, 'big')
-            read_code.buffer_bit_count += 8
-        read_code.buffer_bit_count -= self.code_size
-        code = read_code.buffer >> read_code.buffer_bit_count
-        read_code.buffer &= (1 << read_code.buffer_bit_count) - 1
+            buffer = (buffer << self.UNIT_BITS) | self.in_chunk[self.in_pos]
+            self.in_pos += 1
+            buffer_bit_count += self.UNIT_BITS
+        buffer_bit_count -= code_size
+        code = buffer >> buffer_bit_count
 
+        self.buffer = buffer & ((1 << buffer_bit_count) - 1)
+        self.buffer_bit_count = buffer_bit_count
         return code
 
     '''
@@ -85,80 +180,272 @@ class LZWWriter(BaseLZWWriter):
         Remember to write extra bits to flush the buffer after you have written all the codes
     '''
     def write_code(self, code):
-        write_code = self
-        output_file = self.file
+        out_chunk, unit_bits = self.out_chunk, self.UNIT_BITS
+        buffer = (self.buffer << self.code_size) | code
+        buffer_bit_count = self.buffer_bit_count + self.code_size
 
-        # skeleton code:
-        if not hasattr(write_code, 'buffer'):
-            write_code.buffer = 0
-            write_code.buffer_bit_count = 0
-        write_code.buffer <<= self.code_size
-        write_code.buffer |= code
-        write_code.buffer_bit_count += self.code_size
-        while write_code.buffer_bit_count >= 8:
-            write_code.buffer_bit_count -= 8
-            output_byte = (write_code.buffer >> write_code.buffer_bit_count)
-            output_byte &= 0xFF
-            output_file.write(output_byte.to_bytes(1, 'big'))
-            write_code.buffer &= (1 << write_code.buffer_bit_count) - 1
+        while buffer_bit_count >= unit_bits:
+            buffer_bit_count -= unit_bits
+            out_chunk.append((buffer >> buffer_bit_count) & ((1 << unit_bits) - 1))
+        
+        self.buffer = buffer & ((1 << buffer_bit_count) - 1)
+        self.buffer_bit_count = buffer_bit_count
+        if len(out_chunk) >= CHUNK_SIZE:
+            self.flush_output()
         return
     
     def flush(self):
-        write_code = self
+        # *the last bits are padded with zeros up to a whole unit, however few they are
+        self.align_output()
+        self.flush_output()
+
+    '''
+        *Write an array of codes of size CODE_SIZE with numpy vector operations
+    '''
+    def write_codes(self, codes):
+        if np is None or len(codes) == 0:
+            return super().write_codes(codes)
+        code_size, unit_bits = self.code_size, self.UNIT_BITS
+        codes = np.asarray(codes, dtype=np.uint32) & ((1 << code_size) - 1)
+
+        if code_size == 12 and unit_bits == 8 and self.buffer_bit_count == 0:
+            # two 12-bit codes per 3 bytes
+            pairs = len(codes) // 2
+            c0, c1 = codes[0:2*pairs:2], codes[1:2*pairs:2]
+            packed = np.empty((pairs, 3), dtype=np.uint8)
+            packed[:, 0] = c0 >> 4
+            packed[:, 1] = ((c0 & 0xF) << 4) | (c1 >> 8)
+            packed[:, 2] = c1 & 0xFF
+            self.out_chunk += packed.tobytes()
+            codes = codes[2*pairs:]
+
+        if len(codes) > 0:
+            shifts = np.arange(code_size-1, -1, -1, dtype=np.uint32)
+            bits = ((codes[:, None] >> shifts) & 1).astype(np.uint8).ravel()
+            bits = np.concatenate([int_to_bits(self.buffer, self.buffer_bit_count), bits])
+            n_bits = len(bits) // unit_bits * unit_bits
+            if unit_bits == 8:
+                self.out_chunk += np.packbits(bits[:n_bits]).tobytes()
+            else:
+                weights = np.uint8(1) << np.arange(unit_bits-1, -1, -1, dtype=np.uint8)
+                self.out_chunk += (bits[:n_bits].reshape(-1, unit_bits) @ weights).astype(np.uint8).tobytes()
+            self.buffer, self.buffer_bit_count = bits_to_int(bits[n_bits:]), len(bits) - n_bits
+
+        if len(self.out_chunk) >= CHUNK_SIZE:
+            self.flush_output()
+
+    '''
+        *Read at most n codes of size CODE_SIZE with numpy vector operations
+        Return fewer than n codes if the end of file is reached
+    '''
+    def read_codes(self, n):
+        if np is None:
+            return super().read_codes(n)
+        code_size, unit_bits = self.code_size, self.UNIT_BITS
+        data = np.frombuffer(self.read_buffer((n*code_size - self.buffer_bit_count + unit_bits-1) // unit_bits), dtype=np.uint8)
 
-        if not hasattr(write_code, 'buffer'):
-            write_code.buffer = 0
-            write_code.buffer_bit_count = 0
-        if write_code.buffer_bit_count > 0:
-            self.code_size = write_code.buffer_bit_count
+        if code_size == 12 and unit_bits == 8 and self.buffer_bit_count == 0:
+            # two 12-bit codes per 3 bytes
+            pairs = len(data) // 3
+            triples = data[:3*pairs].reshape(pairs, 3).astype(np.int64)
+            codes = np.empty(2*pairs, dtype=np.int64)
+            codes[0::2] = (triples[:, 0] << 4) | (triples[:, 1] >> 4)
+            codes[1::2] = ((triples[:, 1] & 0xF) << 8) | triples[:, 2]
+            data = data[3*pairs:]
+        else:
+            codes = np.empty(0, dtype=np.int64)
+
+        if unit_bits == 8:
+            bits = np.unpackbits(data)
+        else:
+            bits = np.unpackbits(data[:, None], axis=1)[:, 8-unit_bits:].ravel()
+        bits = np.concatenate([int_to_bits(self.buffer, self.buffer_bit_count), bits])
+        n_codes = len(bits) // code_size
+        weights = np.int64(1) << np.arange(code_size-1, -1, -1, dtype=np.int64)
+        codes = np.concatenate([codes, bits[:n_codes*code_size].reshape(n_codes, code_size) @ weights])
+
+        self.buffer, self.buffer_bit_count = bits_to_int(bits[n_codes*code_size:]), len(bits) - n_codes*code_size
+        return codes
+
+    def align_output(self):
+        if self.buffer_bit_count > 0:
+            code_size = self.code_size
+            self.code_size = self.UNIT_BITS - self.buffer_bit_count
             self.write_code(0)
+            self.code_size = code_size
+
+    def align_input(self):
+        self.buffer = 0
+        self.buffer_bit_count = 0
+
+    def write_bytes(self, data):
+        self.out_chunk += data
+        if len(self.out_chunk) >= CHUNK_SIZE:
+            self.flush_output()
+
+    def read_bytes(self, n):
+        return self.read_buffer(n)
+
+    '''
+        *Read at most n bytes from the input block buffer
+    '''
+    def read_buffer(self, n):
+        data = bytearray()
+        while len(data) < n:
+            if self.in_pos >= len(self.in_chunk) and not self.fill_input():
+                break
+            chunk = self.in_chunk[self.in_pos:self.in_pos + n - len(data)]
+            self.in_pos += len(chunk)
+            data += chunk
+        return bytes(data)
+
+    '''
+        *Skip n bytes, seeking the file past whatever is not in the input block buffer
+    '''
+    def skip_bytes(self, n):
+        available = len(self.in_chunk) - self.in_pos
+        if n <= available:
+            self.in_pos += n
+        elif self.file.seekable():
+            self.file.seek(n - available, os.SEEK_CUR)
+            self.in_chunk, self.in_pos = b'', 0
+        else:
+            self.read_buffer(n)
 
     '''
         Read the file header and return the list of file stored in the compressed file
     '''
     def read_file_header(self):
-        input_file = self.file
-
         # skeleton code:
         output_file_names = []
         while True:
-            line = input_file.readline()
+            line = self.read_line()
             if line == b'' or line == b'\n':
                 break
-            output_file_names.append(line.decode('utf-8').strip())
+            output_file_names.append(line.decode('utf-8', 'surrogatepass').strip())
         return output_file_names
 
     '''
         Write the file header to the compressed file containing names of the files
     '''
     def write_file_header(self, input_file_names):
-        output_file = self.file
+        output_chunk = self.out_chunk
 
         # skeleton code:
         for input_file_name in input_file_names:
-            output_file.write(input_file_name.encode('utf-8') + b'\n')
-        output_file.write(b'\n')
+            # *surrogatepass, as names shifted by EncryptedLZWWriter may be surrogates
+            output_chunk += input_file_name.encode('utf-8', 'surrogatepass') + b'\n'
+        output_chunk += b'\n'
         return
+
+    '''
+        *Read one line (including b'\n') from the input block buffer
+    '''
+    def read_line(self):
+        line = b''
+        while True:
+            if self.in_pos >= len(self.in_chunk) and not self.fill_input():
+                return line
+            end = self.in_chunk.find(b'\n', self.in_pos)
+            if end >= 0:
+                line += self.in_chunk[self.in_pos:end+1]
+                self.in_pos = end+1
+                return line
+            line += self.in_chunk[self.in_pos:]
+            self.in_pos = len(self.in_chunk)
     
+'''
+    *Files can be given either by name or as file objects (e.g. io.BytesIO with a name attribute).
+    The name '-' stands for stdin or stdout.
+'''
+STDIO_NAME = '-'
+
+def file_name(file)->str:
+    return file if isinstance(file, str) else getattr(file, 'name', repr(file))
+
+def open_input_file(file):
+    if file == STDIO_NAME:
+        return contextlib.nullcontext(sys.stdin.buffer)
+    return open(file, 'rb') if isinstance(file, str) else contextlib.nullcontext(file)
+
+'''
+    *Yield the content of an input file in chunks.
+    With use_mmap, the whole file is mapped into memory and yielded as one zero-copy memoryview.
+'''
+def iter_input_chunks(input_file, use_mmap=False):
+    if use_mmap and isinstance(input_file, io.BufferedReader) and os.fstat(input_file.fileno()).st_size > 0:
+        with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                yield view
+        return
+    yield from iter(lambda: input_file.read(CHUNK_SIZE), b'')
+
+def open_output_file(file):
+    if file == STDIO_NAME:
+        return contextlib.nullcontext(sys.stdout.buffer)
+    return open(file, 'wb') if isinstance(file, str) else contextlib.nullcontext(file)
+
+'''
+    *File object that discards everything written to it
+'''
+class DiscardFile:
+    def __init__(self, name):
+        self.name = name
+
+    def write(self, data):
+        return len(data)
+
+'''
+    *Writable file object over a file that is preallocated to its final size and mapped into memory
+'''
+class MmapFile:
+    def __init__(self, name, size):
+        self.name = name
+        self.file = open(name, 'w+b')
+        self.file.truncate(size)
+        self.mapped = mmap.mmap(self.file.fileno(), size)
+        self.pos = 0
+        self.closed = False
+
+    def write(self, data):
+        end = self.pos + len(data)
+        self.mapped[self.pos:end] = data
+        self.pos = end
+        return len(data)
+
+    def close(self):
+        self.mapped.close()
+        self.file.truncate(self.pos)
+        self.file.close()
+        self.closed = True
+
 '''
     *Open file for writing
+    When the sizes of the files are known, they are written through MmapFile
 '''
 class FilesWriter:
-    def __init__(self, file_names):
+    def __init__(self, file_names, sizes=None, log=print):
         self.i = -1
         self.file_names = file_names
+        self.sizes = sizes
+        self.log = log # progress messages are dropped if None
         self.file_name = None
         self.buffer_writer = None
 
     def open(self, i):
         if i >= len(self.file_names):
             return
+        self.close()
         self.i = i
         self.file_name = self.file_names[i]
-        if self.buffer_writer and not self.buffer_writer.closed:
-            self.buffer_writer.close()
-        self.buffer_writer = open(self.file_name, 'wb')
-        print(f"\tDeompressing {self.file_name} ...")
+        if not isinstance(self.file_name, str):
+            self.buffer_writer = self.file_name
+        elif self.sizes is not None and self.sizes[i] > 0:
+            self.buffer_writer = MmapFile(self.file_name, self.sizes[i])
+        else:
+            self.buffer_writer = open(self.file_name, 'wb')
+        if self.log is not None:
+            self.log(f"\tDeompressing {file_name(self.file_name)} ...")
 
     def write(self, i, val):
         if self.i != i:
@@ -166,16 +453,23 @@ class FilesWriter:
         self.buffer_writer.write(val)
 
     def close(self):
+        # file objects passed in are left open for the caller
+        if isinstance(self.file_name, str) and self.buffer_writer and not self.buffer_writer.closed:
+            self.buffer_writer.close()
         self.i = -1
         self.file_name = None
-        if self.buffer_writer and not self.buffer_writer.closed:
-            self.buffer_writer.close()
         self.buffer_writer = None
 
 '''
     *Reinitialize the dictionary.
+    A fresh dictionary holds the 256 single bytes, then the entries of the preset, if any: keys of PrefixLZWDict,
+    prefix_code << 8 | char, each extending a code before it (see PresetDictionary in lzw_enhancements.py).
 '''
 class LZWDict:
+    preset = ()
+
+    def new_dict_comp(self):
+        return dict()
     
     def init_dict_comp(self, DICT:dict)->dict:
         DICT.clear()
@@ -185,6 +479,16 @@ class LZWDict:
     def init_dict_decomp(self, DICT:dict)->dict:
         DICT.clear()
         DICT.update({v: bytes([v]) for v in range(256)})
+        return self.prime_dict_decomp(DICT)
+
+    def prime_dict_comp(self, DICT):
+        for key in self.preset:
+            self.update_dict_comp(DICT, len(DICT), key)
+        return DICT
+
+    def prime_dict_decomp(self, DICT):
+        for key in self.preset:
+            self.append_dict_decomp(DICT, len(DICT), key >> 8, key & 0xFF)
         return DICT
 
     def update_dict_comp(self, DICT:dict, code:int, string:bytes):
@@ -193,90 +497,590 @@ class LZWDict:
     def update_dict_decomp(self, DICT:dict, code:int, string:bytes):
         DICT.update({code: string})
 
+    '''
+        *Decoder operations shared with ArrayLZWDict.
+        Strings are expanded into a reusable output buffer at position pos, and the new position is returned;
+        the buffer is extended when a string runs past its end.
+    '''
+    def new_dict_decomp(self):
+        return dict()
+
+    def expand(self, DICT:dict, code:int, out:bytearray, pos:int)->int:
+        string = DICT[code]
+        out[pos:pos+len(string)] = string
+        return pos+len(string)
+
+    def first_char(self, DICT:dict, code:int)->int:
+        return DICT[code][0]
+
+    def append_dict_decomp(self, DICT:dict, code:int, prefix_code:int, char:int):
+        DICT[code] = DICT[prefix_code] + DICT[char]
+
 '''
-    *Encapsulation of compress-decompress functions
+    *Compression dictionary keyed by integers (prefix_code << 8 | next_byte) instead of byte strings,
+    so that STRING is represented by its code and STRING+CHAR is never built.
 '''
-class LZWProcessor:
+class PrefixLZWDict(LZWDict):
+
+    def init_dict_comp(self, DICT:dict)->dict:
+        DICT.clear()
+        # single bytes are their own codes; the placeholders keep len(DICT) equal to the next free code
+        DICT.update({-1-v: v for v in range(256)})
+        return self.prime_dict_comp(DICT)
+
+    def update_dict_comp(self, DICT:dict, code:int, key:int):
+        DICT[key] = code
+
+'''
+    *Decoding table stored as compact arrays: every entry is its prefix code plus one suffix byte,
+    with the length and first byte of its string cached.
+    The arrays start with the 256 single bytes and are doubled as entries are added, up to max_codes.
+'''
+class LZWDecodeTable:
+    def __init__(self, max_codes:int):
+        typecode = 'H' if max_codes <= 2**16 else 'I'
+        self.max_codes = max_codes
+        self.size = 256
+        self.prefix = array(typecode, bytes(array(typecode).itemsize*256))
+        self.suffix = array('B', range(256))
+        self.first = array('B', range(256))
+        self.length = array(typecode, [1]*256)
+
+    def grow(self):
+        n = min(len(self.suffix), self.max_codes-len(self.suffix))
+        for table in (self.prefix, self.suffix, self.first, self.length):
+            table.frombytes(bytes(table.itemsize*n))
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, code):
+        return code < self.size
+
+'''
+    *Decoding dictionary backed by an LZWDecodeTable instead of a dict of byte strings.
+    Uses a few hundred KB even for 16-bit codes, but expands strings byte by byte, so it is slower than LZWDict.
+    The output buffer is grown when a string does not fit in it.
+'''
+class ArrayLZWDict(LZWDict):
+    def __init__(self, max_codes:int=2**16):
+        self.max_codes = max_codes
+
+    def new_dict_decomp(self):
+        return LZWDecodeTable(self.max_codes)
+
+    def init_dict_decomp(self, DICT:LZWDecodeTable)->LZWDecodeTable:
+        DICT.size = 256
+        return self.prime_dict_decomp(DICT)
+
+    def expand(self, DICT:LZWDecodeTable, code:int, out:bytearray, pos:int)->int:
+        prefix, suffix = DICT.prefix, DICT.suffix
+        end = pos + DICT.length[code]
+        if end > len(out):
+            out.extend(bytes(max(end, 2*len(out))-len(out)))
+        k = end-1
+        while k > pos:
+            out[k] = suffix[code]
+            code = prefix[code]
+            k -= 1
+        out[pos] = code
+        return end
+
+    def first_char(self, DICT:LZWDecodeTable, code:int)->int:
+        return DICT.first[code]
+
+    def append_dict_decomp(self, DICT:LZWDecodeTable, code:int, prefix_code:int, char:int):
+        if code >= len(DICT.suffix):
+            DICT.grow()
+        DICT.prefix[code] = prefix_code
+        DICT.suffix[code] = char
+        DICT.first[code] = DICT.first[prefix_code]
+        DICT.length[code] = DICT.length[prefix_code]+1
+        DICT.size = code+1
+
+'''
+    *Encoding table stored as compact arrays: an open-addressing hash table from the keys of PrefixLZWDict
+    to their codes, doubled whenever it is half full. An empty slot has code 0, which no added entry has.
+'''
+class LZWEncodeTable:
+    MIN_SLOTS = 2**10
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.size = 256
+        self.allocate(self.MIN_SLOTS)
+
+    def allocate(self, slots:int):
+        self.shift = 32 - (slots.bit_length()-1)
+        self.keys = array('I', bytes(4*slots))
+        self.codes = array('I', bytes(4*slots))
+        self.last_key = self.last_code = None # the last key found by __contains__, for __getitem__
+
+    def __len__(self):
+        return self.size
+
+    # Fibonacci hashing: the top bits of the key times 2**32 divided by the golden ratio
+    def slot(self, key:int)->int:
+        return ((key * 2654435769) & 0xFFFFFFFF) >> self.shift
+
+    def __contains__(self, key:int)->bool:
+        codes = self.codes
+        i = ((key * 2654435769) & 0xFFFFFFFF) >> self.shift # slot(), inlined as it is called for every byte
+        code = codes[i]
+        while code:
+            if self.keys[i] == key:
+                self.last_key, self.last_code = key, code
+                return True
+            i = (i+1) & (len(codes)-1)
+            code = codes[i]
+        return False
+
+    def __getitem__(self, key:int)->int:
+        if key == self.last_key:
+            return self.last_code
+        if key not in self:
+            raise KeyError(key)
+        return self.last_code
+
+    def __setitem__(self, key:int, code:int):
+        if 2*(code-255) > len(self.codes):
+            keys, codes = self.keys, self.codes
+            self.allocate(2*len(codes))
+            for old_key, old_code in zip(keys, codes):
+                if old_code:
+                    self.insert(old_key, old_code)
+        self.insert(key, code)
+
+    def insert(self, key:int, code:int):
+        keys, codes = self.keys, self.codes
+        i, mask = self.slot(key), len(codes)-1
+        while codes[i]:
+            i = (i+1) & mask
+        keys[i], codes[i] = key, code
+
+'''
+    *Compression dictionary backed by an LZWEncodeTable instead of a dict.
+    Uses 16 to 32 bytes per entry instead of about 150, but is slower than PrefixLZWDict.
+'''
+class ArrayPrefixLZWDict(PrefixLZWDict):
+
+    def new_dict_comp(self):
+        return LZWEncodeTable()
+
+    def init_dict_comp(self, DICT:LZWEncodeTable)->LZWEncodeTable:
+        DICT.clear()
+        return self.prime_dict_comp(DICT)
+
+    def update_dict_comp(self, DICT:LZWEncodeTable, code:int, key:int):
+        DICT[key] = code
+        DICT.size = code+1
+
+'''
+    *In-memory FIFO of bytes: write() appends to the end and read() consumes from the front
+'''
+class StreamBuffer:
+    def __init__(self, name='<stream>'):
+        self.name = name
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+    def read(self, n=-1):
+        if n < 0 or n > len(self.data):
+            n = len(self.data)
+        chunk = bytes(self.data[:n])
+        del self.data[:n]
+        return chunk
+
+'''
+    *Statistics of a compression run, collected when an LZWStats is passed to LZWProcessor.compress()
+    Timings are split into reading the input, dictionary lookup, bit packing and writing the output.
+    Writing is only timed if the output file is wrapped with wrap_output(); otherwise it counts as bit packing.
+'''
+class LZWStats:
+    TIMINGS = ['read_s', 'compress_s', 'pack_s', 'write_s']
+
+    def __init__(self):
+        self.members = []
+        self.member = None
+        self.overhead = dict.fromkeys(self.TIMINGS, 0.0) # time spent outside of any member, e.g. in finish()
+        self.output_file = None
+
+    def wrap_output(self, file):
+        self.output_file = TimedFile(file, self)
+        return self.output_file
+
+    def add(self, timing, seconds):
+        (self.member or self.overhead)[timing] += seconds
+
     '''
-        Implement your LZW compression
-        You can choose to process one file in one function call or all files together
+        Wrap a function so that the time spent in it is added to the given timing
+    '''
+    def timed(self, fn, timing='compress_s'):
+        def timed_fn(*args):
+            start = time.perf_counter()
+            result = fn(*args)
+            self.add(timing, time.perf_counter() - start)
+            return result
+        return timed_fn
+
+    def timed_chunks(self, chunks):
+        chunks = iter(chunks)
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            self.add('read_s', time.perf_counter() - start)
+            if chunk is None:
+                return
+            self.member['input_bytes'] += len(chunk)
+            yield chunk
+
+    def begin_member(self, name, compressor):
+        self.member = {'name': name, 'input_bytes': 0, **dict.fromkeys(self.TIMINGS, 0.0)}
+        self.counters = compressor.counters()
+
+    def end_member(self, compressor):
+        member = self.member
+        for key, value in compressor.counters().items():
+            member[key] = value - self.counters[key]
+        self.members.append(member)
+        self.member = None
+
     '''
-    @staticmethod
-    def compress(writer:BaseLZWWriter, input_file_names):
-        print(f"\nCompressing {', '.join(input_file_names)} into {writer.name}")
+        Return the statistics as a JSON-serializable dict, with a summary of all members
+    '''
+    def to_dict(self)->dict:
+        members = [self.summarize(member) for member in self.members]
+        total = {'input_bytes': 0, 'codes': 0, 'bits': 0, 'width_changes': 0, 'resets': 0, **self.overhead}
+        for member in self.members:
+            for key in total:
+                total[key] += member[key]
+        total = self.summarize(total, len(self.members))
+        if self.output_file is not None:
+            total['output_bytes'] = self.output_file.bytes_written
+            total['ratio'] = self.output_file.bytes_written / total['input_bytes'] if total['input_bytes'] else None
+        return {**total, 'members': members}
+
+    def summarize(self, member:dict, member_count=1)->dict:
+        member = dict(member)
+        # the timings are nested: writing happens within bit packing, which happens within compress_s
+        member['lookup_s'] = member['compress_s'] - member['pack_s']
+        member['pack_s'] -= member['write_s']
+        del member['compress_s']
+        data_codes = member['codes'] - member_count # without the EOF of each member
+        member['average_match_length'] = member['input_bytes'] / data_codes if data_codes > 0 else None
+        member['output_bytes'] = (member.pop('bits') + 7) // 8
+        member['ratio'] = member['output_bytes'] / member['input_bytes'] if member['input_bytes'] else None
+        return member
+
+'''
+    *Output file that measures the time spent in and the number of bytes passed to write()
+'''
+class TimedFile:
+    def __init__(self, file, stats:LZWStats):
+        self.file = file
+        self.name = file_name(file)
+        self.stats = stats
+        self.bytes_written = 0
+
+    def write(self, data):
+        start = time.perf_counter()
+        n = self.file.write(data)
+        self.stats.add('write_s', time.perf_counter() - start)
+        self.bytes_written += len(data)
+        return n
+
+    def close(self):
+        self.file.close()
+
+'''
+    *Override the code sizes of a compressor or decompressor class with max_bits, the code size of fixed-width code
+    or the largest code size of variable-width code
+'''
+def set_max_bits(coder, max_bits:int=None):
+    if max_bits is not None:
+        if coder.MIN_BITS == coder.MAX_BITS: # fixed-width code stays fixed-width
+            coder.MIN_BITS = max_bits
+        coder.MAX_BITS = max_bits
 
-        lzw_dict = LZWDict()
-        DICT = lzw_dict.init_dict_comp(dict())
+'''
+    *A preset has to leave room for new entries below the dictionary limit
+'''
+def check_preset_fits(coder):
+    if len(coder.DICT) >= coder.DICT_LIMIT-1:
+        raise ValueError(f'Error: the preset dictionary of {len(coder.lzw_dict.preset)} entries does not fit in {coder.MAX_BITS}-bit codes')
+
+'''
+    *Incremental LZW compression, like zlib.compressobj()
+    Codes go to the given writer; without one they are packed in memory, and feed() and finish() return them.
+    Every input file is a member of the stream: call end_member() after feeding it, and finish() after the last one.
+'''
+class LZWCompressor:
+    COMP_DICT = PrefixLZWDict # dictionary used for compression
+    COMPACT_DICT = ArrayPrefixLZWDict # *dictionary used from COMPACT_BITS
+    MIN_BITS = MAX_BITS = CODE_SIZE # *fixed-width code has MIN_BITS == MAX_BITS
+
+    def __init__(self, writer:BaseLZWWriter=None, stats:LZWStats=None, max_bits:int=None, preset=None):
+        self.sink = None
+        if writer is None:
+            self.sink = StreamBuffer()
+            writer = LZWWriter(self.sink)
+        self.writer = writer
+        self.stats = stats
+        set_max_bits(self, max_bits)
+        self.lzw_dict = self.COMP_DICT() if self.MAX_BITS < COMPACT_BITS else self.COMPACT_DICT()
+        if preset is not None:
+            self.lzw_dict.preset = preset
+        self.DICT = self.lzw_dict.init_dict_comp(self.lzw_dict.new_dict_comp())
+        self.STRING = None
+        self.N_BITS = self.MAX_BITS
+        self.EOF = self.DICT_LIMIT = 2**self.MAX_BITS-1
+        check_preset_fits(self)
+        writer.set_code_size(self.N_BITS)
+        self.codes = array('I') # codes are written to the writer in bulk
         writer.initialize()
 
-        for input_file_name in input_file_names:
-            STRING, CHAR = None, None
-            with open(input_file_name, 'rb') as input_file:
-                print(f"\tCompressing {input_file.name} ...")
-                if STRING is None:
-                    STRING = input_file.read(1)
-                while True:
-                    CHAR = input_file.read(1)
-                    if CHAR == b'': break
-                    if STRING+CHAR in DICT:
-                        STRING += CHAR
-                    else:
-                        writer.write_code(DICT[STRING])
-                        if len(DICT) >= DICT_LIMIT:
-                            lzw_dict.init_dict_comp(DICT)
-                        else:
-                            lzw_dict.update_dict_comp(DICT, len(DICT), STRING+CHAR)
-                        STRING = CHAR
-                writer.write_code(DICT[STRING])
-                writer.write_code(EOF)
-        
-        writer.write_code(EOF)
-        writer.flush()
+        # *counters reported by LZWStats
+        self.codes_written = 0
+        self.bits_written = 0
+        self.width_changes = 0
+        self.resets = 0
 
-        print("\tDone.")
+    def counters(self)->dict:
+        return {
+            'codes': self.codes_written + len(self.codes),
+            'bits': self.bits_written + len(self.codes)*self.N_BITS,
+            'width_changes': self.width_changes,
+            'resets': self.resets,
+        }
 
     '''
-        Implement your LZW decompression
-        You can choose to process one file in one function call or all files together
+        *Write the pending codes to the writer; they all have the current code size
+    '''
+    def write_codes(self):
+        self.codes_written += len(self.codes)
+        self.bits_written += len(self.codes)*self.N_BITS
+        if self.stats is None:
+            self.writer.write_codes(self.codes)
+        else:
+            self.stats.timed(self.writer.write_codes, 'pack_s')(self.codes)
+        del self.codes[:]
+
+    '''
+        *Return the compressed bytes produced so far, if the codes are packed in memory
+    '''
+    def drain(self)->bytes:
+        return self.sink.read() if self.sink is not None else b''
+
+    def feed(self, chunk)->bytes:
+        lzw_dict, DICT, codes, DICT_LIMIT = self.lzw_dict, self.DICT, self.codes, self.DICT_LIMIT
+        chars = iter(chunk)
+        STRING = self.STRING
+        if STRING is None:
+            STRING = next(chars, None)
+        for CHAR in chars:
+            KEY = (STRING << 8) | CHAR
+            if KEY in DICT:
+                STRING = DICT[KEY]
+            else:
+                codes.append(STRING)
+                if len(codes) >= CHUNK_SIZE:
+                    self.write_codes()
+                if len(DICT) >= DICT_LIMIT:
+                    lzw_dict.init_dict_comp(DICT)
+                    self.resets += 1
+                else:
+                    lzw_dict.update_dict_comp(DICT, len(DICT), KEY)
+                STRING = CHAR
+        self.STRING = STRING
+        return self.drain()
+
+    '''
+        *End the current member with EOF; an empty member is a lone EOF
     '''
-    @staticmethod
-    def decompress(reader:BaseLZWWriter, output_file_names):
-        print(f"\nDeompressing {reader.name} into {', '.join(output_file_names)}")
+    def end_member(self):
+        if self.STRING is not None:
+            self.codes.append(self.STRING)
+        self.codes.append(self.EOF)
+        self.STRING = None
 
-        lzw_dict = LZWDict()
-        DICT = lzw_dict.init_dict_decomp(dict())
+    '''
+        *End the stream with another EOF and flush the writer.
+        The last EOF is only read if the stream is empty, so variable-width code, which is then at MIN_BITS,
+        keeps writing the 12-bit EOF cut to the code size, as it always has.
+    '''
+    def finish(self)->bytes:
+        if self.STRING is not None:
+            self.end_member()
+        self.codes.append(self.EOF if self.MIN_BITS == self.MAX_BITS else EOF & ((1 << self.N_BITS)-1))
+        self.write_codes()
+        if self.stats is None:
+            self.writer.flush()
+        else:
+            self.stats.timed(self.writer.flush, 'pack_s')()
+        return self.drain()
+
+'''
+    *Incremental LZW decompression, like zlib.decompressobj()
+    Codes come from the given reader; without one, feed() takes the compressed bytes and returns the decoded bytes.
+    The decoded members go to the given FilesWriter, or are concatenated in memory without one.
+'''
+class LZWDecompressor:
+    MIN_BITS = MAX_BITS = CODE_SIZE
+
+    def __init__(self, reader:BaseLZWWriter=None, writer:FilesWriter=None, members:int=1, lzw_dict:LZWDict=None, max_bits:int=None, preset=None):
+        self.source = None
+        if reader is None:
+            self.source = StreamBuffer()
+            reader = LZWWriter(self.source)
+        self.sink = None
+        if writer is None:
+            self.sink = StreamBuffer()
+            writer = FilesWriter([self.sink]*members, log=None)
+        self.reader, self.writer, self.members = reader, writer, members
+        set_max_bits(self, max_bits)
+        self.EOF = self.DICT_LIMIT = 2**self.MAX_BITS-1
+        reader.set_code_size(self.MAX_BITS)
+        self.lzw_dict = lzw_dict or (LZWDict() if self.MAX_BITS < COMPACT_BITS else ArrayLZWDict(2**self.MAX_BITS))
+        if preset is not None:
+            self.lzw_dict.preset = preset
+        self.DICT = self.lzw_dict.init_dict_decomp(self.lzw_dict.new_dict_decomp())
+        check_preset_fits(self)
+        self.CURRENT = None
+        self.i = 0 # index of the current member
+
+        # decoded strings are expanded into one reusable buffer and written out in chunks;
+        # the buffer is grown by expand() when a string does not fit
+        self.out = bytearray(2*CHUNK_SIZE)
         reader.initialize()
 
-        STRING, CHAR = None, None
+    '''
+        *Return the decoded bytes produced so far, if they are kept in memory
+    '''
+    def drain(self)->bytes:
+        return self.sink.read() if self.sink is not None else b''
 
-        CURRENT = reader.read_code()
-        writer = FilesWriter(output_file_names)
-        i = 0
-        while True:
-            NEXT = reader.read_code()
-            if NEXT == EOF: 
-                writer.write(i, DICT[CURRENT])
-                i += 1
-                if i >= len(writer.file_names):
-                    break
+    def feed(self, chunk)->bytes:
+        self.source.write(chunk)
+        self.decode()
+        return self.drain()
+
+    '''
+        *Decode all complete codes available from the reader
+    '''
+    def decode(self):
+        lzw_dict, DICT, out, writer = self.lzw_dict, self.DICT, self.out, self.writer
+        EOF, DICT_LIMIT = self.EOF, self.DICT_LIMIT
+        CURRENT, i, pos = self.CURRENT, self.i, 0
+        if i >= self.members:
+            return
 
-                CURRENT = reader.read_code()
-                STRING, CHAR = None, None
+        for NEXT in self.reader.iter_codes(): # codes are read from the reader in bulk
+            if CURRENT is None:
+                if NEXT == EOF: # empty member
+                    writer.write(i, b'')
+                    i += 1
+                    if i >= self.members: break
+                else:
+                    CURRENT = NEXT
+                continue
+            pos = lzw_dict.expand(DICT, CURRENT, out, pos)
+            if NEXT == EOF:
+                writer.write(i, memoryview(out)[:pos])
+                pos = 0
+                CURRENT = None
+                i += 1
+                if i >= self.members: break
                 continue
-            STRING = DICT[CURRENT]
-            writer.write(i, STRING)
-            if NEXT is None: break #
+            if pos >= CHUNK_SIZE:
+                writer.write(i, memoryview(out)[:pos])
+                pos = 0
             if NEXT in DICT:
-                CHAR = bytes([DICT[NEXT][0]])
+                CHAR = lzw_dict.first_char(DICT, NEXT)
             else:
-                CHAR = bytes([STRING[0]])
+                CHAR = lzw_dict.first_char(DICT, CURRENT)
             if len(DICT) >= DICT_LIMIT:
                 lzw_dict.init_dict_decomp(DICT)
             else:
-                lzw_dict.update_dict_decomp(DICT, len(DICT), STRING+CHAR)
+                lzw_dict.append_dict_decomp(DICT, len(DICT), CURRENT, CHAR)
             CURRENT = NEXT
-        
-        writer.close()
+
+        if pos > 0:
+            writer.write(i, memoryview(out)[:pos])
+        self.CURRENT, self.i = CURRENT, i
+
+    '''
+        *Decode the rest of the stream; a stream cut short ends with the pending code
+    '''
+    def finish(self)->bytes:
+        self.decode()
+        if self.CURRENT is not None and self.i < self.members:
+            pos = self.lzw_dict.expand(self.DICT, self.CURRENT, self.out, 0)
+            self.writer.write(self.i, memoryview(self.out)[:pos])
+            self.CURRENT = None
+        self.writer.close()
+        return self.drain()
+
+'''
+    *Encapsulation of compress-decompress functions
+    Processors hold no state: every call works in a compressor or decompressor session of its own,
+    with its own writer, so that sessions can run concurrently in threads.
+'''
+class LZWProcessor:
+    COMPRESSOR = LZWCompressor
+    DECOMPRESSOR = LZWDecompressor
+    VARIANT = None # *name recorded in the header of archives made with another LZW variant
+    CLEAR = False # *whether the dictionary is reset with CLEAR codes, recorded in the header
+
+    '''
+        Implement your LZW compression
+        You can choose to process one file in one function call or all files together
+        *Return the CRC32 of every input file, computed over its chunks as they are compressed
+    '''
+    @classmethod
+    def compress(cls, writer:BaseLZWWriter, input_file_names, use_mmap=False, stats:LZWStats=None, max_bits:int=None, preset=None):
+        print(f"\nCompressing {', '.join(map(file_name, input_file_names))} into {writer.name}")
+
+        compressor = cls.COMPRESSOR(writer, stats, max_bits, preset)
+        feed, end_member, finish = compressor.feed, compressor.end_member, compressor.finish
+        if stats is not None:
+            feed, end_member, finish = stats.timed(feed), stats.timed(end_member), stats.timed(finish)
+        crcs = []
+        for input_file_name in input_file_names:
+            with open_input_file(input_file_name) as input_file:
+                print(f"\tCompressing {file_name(input_file)} ...")
+                chunks = iter_input_chunks(input_file, use_mmap)
+                if stats is not None:
+                    stats.begin_member(file_name(input_file), compressor)
+                    chunks = stats.timed_chunks(chunks)
+                crc = 0
+                for chunk in chunks:
+                    feed(chunk)
+                    crc = zlib.crc32(chunk, crc)
+                end_member()
+                crcs.append(crc)
+                if stats is not None:
+                    stats.end_member(compressor)
+        finish()
+
+        print("\tDone.")
+        return crcs
+
+    '''
+        Implement your LZW decompression
+        You can choose to process one file in one function call or all files together
+    '''
+    @classmethod
+    def decompress(cls, reader:BaseLZWWriter, output_file_names, lzw_dict:LZWDict=None, sizes=None, max_bits:int=None, preset=None):
+        print(f"\nDeompressing {reader.name} into {', '.join(map(file_name, output_file_names))}")
+
+        writer = FilesWriter(output_file_names, sizes)
+        decompressor = cls.DECOMPRESSOR(reader, writer, len(output_file_names), lzw_dict, max_bits, preset)
+        decompressor.finish()
                 
         print("\tDone.")
 
@@ -0,0 +1,303 @@
+import json
+import time
+import filecmp
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from lzw_enhancements import *
+
+# *resource is not available on Windows, where peak memory is not reported
+try:
+    import resource
+except ImportError:
+    resource = None
+
+CORPORA = ['text', 'bitmap', 'random', 'repetitive']
+PROCESSORS = [*LZW_PROCESSORS.values(), *CLEAR_CODE_PROCESSORS.values(), *VARIANT_PROCESSORS.values()]
+SIZE_UNITS = {'K': 2**10, 'M': 2**20, 'G': 2**30}
+CORPUS_CHUNK_SIZE = 2**20 # corpora are generated in chunks of this size, so that 1 GB fits in memory
+DAEMON_FILE_SIZE = '4K' # size of the small files of the daemon benchmark
+
+'''
+    Parse command line arguments
+'''
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark every processor, binary-to-text encoding and cipher combination')
+    parser.add_argument('--corpora', type=str, nargs='+', default=CORPORA, choices=CORPORA, help='Corpora to generate (Default: all)')
+    parser.add_argument('--sizes', type=str, nargs='+', default=['1K', '64K', '1M'], help='Corpus sizes, e.g. 1K 10M 1G (Default: 1K 64K 1M)')
+    parser.add_argument('--seed', type=int, default=3280, help='Seed of the generated corpora (Default: 3280)')
+    parser.add_argument('-e', '--encrypt', type=int, default=32, help='Integer encryption key of the encrypted runs (Default: 32)')
+    parser.add_argument('--threads', type=int, default=None, help='Also run every combination of the in-memory API in this many concurrent threads, checking that the results match the serial ones (Default: no concurrent runs)')
+    parser.add_argument('--daemon', type=int, default=None, help=f'Also compress this many small text files ({DAEMON_FILE_SIZE}) with one lzw_enhancements.py run each, and through lzw_server.py with one lzw_client.py run each (Default: no daemon runs)')
+    parser.add_argument('-o', type=str, default=None, help='Output JSON file (Default: stdout)')
+    return parser.parse_args()
+
+def parse_size(size:str)->int:
+    size = size.strip().upper()
+    if size[-1] in SIZE_UNITS:
+        return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+    return int(size)
+
+'''
+    *Corpus generators
+    Each yields chunks of at most CORPUS_CHUNK_SIZE bytes, adding up to exactly size bytes.
+'''
+def iter_chunks(size, make_chunk):
+    while size > 0:
+        chunk = make_chunk(min(size, CORPUS_CHUNK_SIZE))[:size]
+        size -= len(chunk)
+        yield chunk
+
+def text_corpus(size, rng:random.Random):
+    sample = join(dirname(os.path.abspath(__file__)), 'input', 'CSE.txt')
+    words = b'the quick brown fox jumps over the lazy dog'.split()
+    if isfile(sample):
+        with open(sample, 'rb') as sample_file:
+            words = sample_file.read().split()
+
+    def make_chunk(n):
+        chunk = bytearray()
+        while len(chunk) < n:
+            line = b' '.join(rng.choice(words) for _ in range(rng.randint(5, 15)))
+            chunk += line + b'.\r\n'
+        return bytes(chunk)
+    return iter_chunks(size, make_chunk)
+
+'''
+    *24-bit BMP: a header followed by rows of gradients and flat rectangles, like a screenshot or a drawing
+'''
+def bitmap_corpus(size, rng:random.Random):
+    width = 1024
+    height = max(1, size // (3*width))
+    header = b'BM' + (54 + 3*width*height).to_bytes(4, 'little') + bytes(4) + (54).to_bytes(4, 'little')
+    header += (40).to_bytes(4, 'little') + width.to_bytes(4, 'little') + height.to_bytes(4, 'little')
+    header += (1).to_bytes(2, 'little') + (24).to_bytes(2, 'little') + bytes(24)
+    rectangles = [(rng.randrange(width), rng.randrange(width), bytes(rng.randrange(256) for _ in range(3))) for _ in range(8)]
+
+    # the pixels repeat every 1024 rows
+    def make_row(y):
+        row = bytearray()
+        for x in range(width):
+            row += bytes(((x + y) // 4 % 256, y // 4 % 256, x // 4 % 256))
+        for left, right, color in rectangles:
+            if (y // 64) % 2 == 0 and left < right:
+                row[3*left:3*right] = color * (right-left)
+        return bytes(row)
+
+    def rows():
+        yield header
+        cache = dict()
+        y = 0
+        while True:
+            if y % 1024 not in cache:
+                cache[y % 1024] = make_row(y % 1024)
+            yield cache[y % 1024]
+            y += 1
+
+    def make_chunks():
+        buffer = bytearray()
+        for row in rows():
+            buffer += row
+            if len(buffer) >= CORPUS_CHUNK_SIZE:
+                yield bytes(buffer)
+                buffer.clear()
+
+    chunks = make_chunks()
+    return iter_chunks(size, lambda n: next(chunks))
+
+def random_corpus(size, rng:random.Random):
+    return iter_chunks(size, rng.randbytes)
+
+def repetitive_corpus(size, rng:random.Random):
+    pattern = b'2024-03-23 12:00:00 INFO worker-1 request served in 15 ms\n'
+    def make_chunk(n):
+        chunk = bytearray()
+        while len(chunk) < n:
+            chunk += pattern * rng.randint(1, 50) + str(rng.randrange(1000)).encode()
+        return bytes(chunk)
+    return iter_chunks(size, make_chunk)
+
+CORPUS_GENERATORS = {'text': text_corpus, 'bitmap': bitmap_corpus, 'random': random_corpus, 'repetitive': repetitive_corpus}
+
+def write_corpus(path, corpus, size, seed):
+    with open(path, 'wb') as output_file:
+        for chunk in CORPUS_GENERATORS[corpus](size, random.Random(seed)):
+            output_file.write(chunk)
+
+'''
+    *Compress and decompress one corpus file with one combination, in a fresh process
+    so that the peak memory is that of this run alone
+'''
+def run_case(input_file_name, lzw_processor, text, encrypt_key, cipher='random'):
+    encryptor = ENCRYPTORS[cipher]
+    base_writer = BASE_WRITERS[text]
+    archive_name = input_file_name + '.lzw'
+    output_dir = input_file_name + '.out'
+    os.makedirs(output_dir, exist_ok=True)
+    output_file_name = join(output_dir, basename(input_file_name))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        with open(archive_name, 'wb') as output_file:
+            writer = encryptor(base_writer(output_file, code_size=CODE_SIZE), encrypt_key=encrypt_key)
+            writer.write_file_header([input_file_name])
+            lzw_processor.compress(writer, [input_file_name])
+        compress_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with open(archive_name, 'rb') as input_file:
+            reader = encryptor(base_writer(input_file, code_size=CODE_SIZE), encrypt_key=encrypt_key)
+            reader.read_file_header()
+            lzw_processor.decompress(reader, [output_file_name])
+        decompress_time = time.perf_counter() - start
+
+    size = os.path.getsize(input_file_name)
+    compressed_size = os.path.getsize(archive_name)
+    result = {
+        'compress_mb_s': size / 2**20 / compress_time,
+        'decompress_mb_s': size / 2**20 / decompress_time,
+        'compressed_size': compressed_size,
+        'ratio': compressed_size / size if size else None,
+        'peak_memory_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+        'ok': filecmp.cmp(input_file_name, output_file_name, shallow=False),
+    }
+    os.remove(archive_name)
+    os.remove(output_file_name)
+    return result
+
+'''
+    *Compress and decompress one corpus file in memory with every combination, once serially
+    and then threads times over in a thread pool; every concurrent session must give the serial result
+'''
+def compress_session(data, lzw_processor, text, key, cipher)->bytes:
+    output_file = io.BytesIO()
+    compressor = lzw_processor.COMPRESSOR(make_writer(output_file, key, text, cipher))
+    compressor.feed(data)
+    compressor.finish()
+    return output_file.getvalue()
+
+def run_concurrent(input_file_name, threads, encrypt_key):
+    with open(input_file_name, 'rb') as input_file:
+        data = input_file.read()
+    cases = [(lzw_processor, text, key, cipher) for lzw_processor in PROCESSORS for text in BASE_WRITERS
+        for key, cipher in ((None, 'random'), (encrypt_key, 'random'), (encrypt_key, 'keystream'))]
+
+    start = time.perf_counter()
+    blobs = [compress_session(data, *case) for case in cases]
+    serial_time = time.perf_counter() - start
+
+    def session(i):
+        lzw_processor, text, key, cipher = cases[i % len(cases)]
+        blob = compress_session(data, lzw_processor, text, key, cipher)
+        return blob == blobs[i % len(cases)] and decompress_bytes(blob, key=key, text=text, cipher=cipher, lzw_processor=lzw_processor) == data
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(session, range(threads*len(cases))))
+    concurrent_time = time.perf_counter() - start
+
+    return {
+        'threads': threads,
+        'sessions': len(results),
+        'serial_compress_mb_s': len(cases) * len(data) / 2**20 / serial_time,
+        'concurrent_mb_s': len(results) * len(data) / 2**20 / concurrent_time, # compression and decompression
+        'ok': all(results),
+    }
+
+'''
+    *Compress count small files with one command line run each, then through a daemon started for the benchmark,
+    with one client run each and with requests from this process; every archive must match the command line one
+'''
+def run_daemon(temp_dir, count, seed):
+    script_dir = dirname(os.path.abspath(__file__))
+    input_file_names = [join(temp_dir, f'small_{i}.txt') for i in range(count)]
+    for i, input_file_name in enumerate(input_file_names):
+        write_corpus(input_file_name, 'text', parse_size(DAEMON_FILE_SIZE), seed + i)
+
+    def run_each(command, suffix):
+        start = time.perf_counter()
+        for input_file_name in input_file_names:
+            subprocess.run([sys.executable, *command, '-c', input_file_name + suffix, input_file_name], check=True, stdout=subprocess.DEVNULL)
+        return time.perf_counter() - start
+
+    def same_archives(suffix):
+        return all(filecmp.cmp(name + '.cli.lzw', name + suffix, shallow=False) for name in input_file_names)
+
+    cli_time = run_each([join(script_dir, 'lzw_enhancements.py')], '.cli.lzw')
+
+    socket_path = join(temp_dir, 'lzw.sock')
+    server = subprocess.Popen([sys.executable, join(script_dir, 'lzw_server.py'), '--socket', socket_path], stdout=subprocess.PIPE, text=True)
+    try:
+        server.stdout.readline() # the daemon prints a line once it is listening
+        client_time = run_each([join(script_dir, 'lzw_client.py'), '--socket', socket_path], '.client.lzw')
+
+        import lzw_client
+        start = time.perf_counter()
+        for input_file_name in input_file_names:
+            with open(input_file_name, 'rb') as input_file:
+                blob = lzw_client.compress_files({input_file_name: input_file.read()}, socket_path=socket_path)
+            with open(input_file_name + '.request.lzw', 'wb') as output_file:
+                output_file.write(blob)
+        request_time = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'files': count,
+        'file_size': parse_size(DAEMON_FILE_SIZE),
+        'cli_files_s': count / cli_time,
+        'client_files_s': count / client_time,
+        'request_files_s': count / request_time,
+        'ok': same_archives('.client.lzw') and same_archives('.request.lzw'),
+    }
+
+def main():
+    opt = parse_args()
+
+    results, concurrent_results = [], []
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for corpus in opt.corpora:
+            for size in opt.sizes:
+                input_file_name = join(temp_dir, f'{corpus}_{size}')
+                write_corpus(input_file_name, corpus, parse_size(size), opt.seed)
+                for lzw_processor in PROCESSORS:
+                    for text in BASE_WRITERS:
+                        for encrypt_key, cipher in ((None, 'random'), (opt.encrypt, 'random'), (opt.encrypt, 'keystream')):
+                            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                                result = executor.submit(run_case, input_file_name, lzw_processor, text, encrypt_key, cipher).result()
+                            result = {
+                                'corpus': corpus,
+                                'size': parse_size(size),
+                                'processor': lzw_processor.__name__,
+                                'writer': BASE_WRITERS[text].__name__,
+                                'encrypted': encrypt_key is not None,
+                                'cipher': cipher if encrypt_key is not None else None,
+                                **result,
+                            }
+                            print(json.dumps(result), file=sys.stderr)
+                            results.append(result)
+                if opt.threads is not None:
+                    result = {'corpus': corpus, 'size': parse_size(size), **run_concurrent(input_file_name, opt.threads, opt.encrypt)}
+                    print(json.dumps(result), file=sys.stderr)
+                    concurrent_results.append(result)
+                os.remove(input_file_name)
+        if opt.daemon is not None:
+            daemon_result = run_daemon(temp_dir, opt.daemon, opt.seed)
+            print(json.dumps(daemon_result), file=sys.stderr)
+
+    report = {'python': sys.version, 'seed': opt.seed, 'results': results}
+    if opt.threads is not None:
+        report['concurrent_results'] = concurrent_results
+    if opt.daemon is not None:
+        report['daemon_result'] = daemon_result
+    if opt.o is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(opt.o, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+if __name__ == '__main__':
+    main()
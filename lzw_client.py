@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import socket
+import argparse
+import tempfile
+from os.path import join, basename, dirname, isfile
+
+'''
+    *Thin client of the compression daemon (lzw_server.py)
+    It imports nothing from the compressor, so that each invocation only pays for interpreter startup;
+    archives are the same as those written by lzw_enhancements.py with the same options.
+
+    Protocol, over a Unix domain socket, one request per connection:
+    every message is a frame of FRAME_PREFIX_SIZE hex digits of length followed by that many bytes.
+    The request is a JSON frame {"op": "compress" or "decompress", "names": [...], "variable", "key", "text", "cipher", "max_bits"},
+    followed by one data frame per name (compress) or a single frame of the archive (decompress).
+    The response is a JSON frame {"ok": true, "names": [...]} followed by one data frame per name,
+    the archive (compress) or the files (decompress); or {"ok": false, "type": "...", "error": "..."}
+    with the name of the type of the exception raised in the daemon and its message.
+    A request that cannot be read, with a bad length prefix, a frame over the limit of the daemon (--max-frame)
+    or invalid JSON, is answered with such an error too.
+'''
+FRAME_PREFIX_SIZE = 8
+DEFAULT_SOCKET = join(tempfile.gettempdir(), 'lzw.sock')
+
+'''
+    Parse command line arguments
+'''
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Compress or decompress files through the LZW compression daemon')
+
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-c', dest='c', type=str, help='Output file of compressed data')
+    parser.add_argument('-o', type=str, default=join('.', 'output'), help='Output directory')
+    parser.add_argument('input_files', type=str, nargs='*', help='Input files to be compressed')
+    group.add_argument('-d', dest='d', type=str, help='Input file to be decompressed')
+
+    parser.add_argument('-e', '--encrypt', type=int, default=None, help='Integer encryption key (Default: no encryption)')
+    parser.add_argument('--cipher', type=str, default='random', choices=['random', 'keystream'], help='Encryption scheme (Default: random)')
+    parser.add_argument('-t', '--text', type=str, default='none', choices=['none', 'hex', 'base64'], help='Binary-to-text encoding scheme used (Default: no binary-to-text)')
+    parser.add_argument('-v', '--variable', action='store_true', help='Whether variable-width code is used (Default: no)')
+    parser.add_argument('--bits', type=int, default=None, help='Code size, as in lzw_enhancements.py (Default: 12, or 16 with -v)')
+    parser.add_argument('--socket', type=str, default=DEFAULT_SOCKET, help=f'Socket of the daemon (Default: {DEFAULT_SOCKET})')
+
+    return parser.parse_args(), parser.print_help
+
+'''
+    *Exception raised in the daemon, with the name of its type (ChecksumError, KeyError, ...)
+'''
+class DaemonError(ValueError):
+    def __init__(self, type_name:str, message:str):
+        super().__init__(f'{type_name}: {message}' if message else type_name)
+        self.type = type_name
+
+def send_frame(sock:socket.socket, data:bytes):
+    sock.sendall(f'{len(data):0{FRAME_PREFIX_SIZE}x}'.encode() + data)
+
+def read_frame(file)->bytes:
+    prefix = file.read(FRAME_PREFIX_SIZE)
+    if len(prefix) < FRAME_PREFIX_SIZE:
+        raise ConnectionError('Error: the daemon closed the connection')
+    size = int(prefix, 16)
+    data = file.read(size)
+    if len(data) < size:
+        raise ConnectionError('Error: the daemon closed the connection')
+    return data
+
+'''
+    *Send one request and yield (name, data) of the response as its frames arrive
+'''
+def request(op, names:list, frames:list, variable=False, key=None, text='none', cipher='random', max_bits:int=None, socket_path=DEFAULT_SOCKET):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise ConnectionError(f'Error: no daemon is listening on {socket_path}; start one with lzw_server.py')
+        header = {'op': op, 'names': names, 'variable': variable, 'key': key, 'text': text, 'cipher': cipher, 'max_bits': max_bits}
+        send_frame(sock, json.dumps(header).encode())
+        for frame in frames:
+            send_frame(sock, frame)
+
+        with sock.makefile('rb') as response:
+            status = json.loads(read_frame(response))
+            if not status['ok']:
+                raise DaemonError(status.get('type', 'ValueError'), status['error'])
+            for name in status['names']:
+                yield name, read_frame(response)
+
+def compress_files(files:dict[str, bytes], variable=False, key=None, text='none', cipher='random', max_bits:int=None, socket_path=DEFAULT_SOCKET)->bytes:
+    return b''.join(data for _, data in request('compress', list(files), list(files.values()), variable, key, text, cipher, max_bits, socket_path))
+
+def decompress_files(blob, variable=False, key=None, text='none', cipher='random', socket_path=DEFAULT_SOCKET)->dict[str, bytes]:
+    return dict(request('decompress', [], [blob], variable, key, text, cipher, None, socket_path))
+
+def main():
+    opt, print_usage = parse_args()
+    options = {'variable': opt.variable, 'key': opt.encrypt, 'text': opt.text, 'cipher': opt.cipher, 'socket_path': opt.socket}
+
+    try:
+        if opt.c is not None and opt.input_files != []:
+            files = dict()
+            for input_file_name in opt.input_files:
+                if not isfile(input_file_name):
+                    raise ValueError(f'Error: file {input_file_name} does not exist')
+                if input_file_name in files:
+                    raise ValueError(f'Error: file {input_file_name} is given more than once')
+                with open(input_file_name, 'rb') as input_file:
+                    files[input_file_name] = input_file.read()
+
+            blob = compress_files(files, max_bits=opt.bits, **options)
+            os.makedirs(dirname(opt.c) or '.', exist_ok=True)
+            with open(opt.c, 'wb') as output_file:
+                output_file.write(blob)
+
+        elif opt.d is not None and opt.input_files == []:
+            with open(opt.d, 'rb') as input_file:
+                blob = input_file.read()
+
+            # files are written as their frames arrive
+            os.makedirs(opt.o, exist_ok=True)
+            for name, data in request('decompress', [], [blob], **options):
+                with open(join(opt.o, basename(name)), 'wb') as output_file:
+                    output_file.write(data)
+
+        else:
+            print_usage()
+    except (OSError, ValueError) as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,15 @@
+import io
+import json
+import zlib
+import asyncio
+import hashlib
+import binascii
+import shutil
+import tempfile
+import logging
+from itertools import repeat, count
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from lzw import *
 
 '''
@@ -8,19 +20,53 @@ def parse_args():
     parser = argparse.ArgumentParser(description='Compress or decompress files using LZW algorithm (Enhancements Part)')
 
     group = parser.add_mutually_exclusive_group()
-    group.add_argument('-c', dest='c', type=str, help='Output file of compressed data')
-    parser.add_argument('-o', type=str, default=join('.', 'output'), help='Output directory')
-    parser.add_argument('input_files', type=str, nargs='*', help='Input files to be compressed')
-    group.add_argument('-d', dest='d', type=str, help='Input file to be decompressed')
+    group.add_argument('-c', dest='c', type=str, help='Output file of compressed data (- for stdout)')
+    parser.add_argument('-o', type=str, default=join('.', 'output'), help='Output directory (- to write all files to stdout)')
+    parser.add_argument('input_files', type=str, nargs='*', help='Input files to be compressed (- for stdin)')
+    group.add_argument('-d', dest='d', type=str, help='Input file to be decompressed (- for stdin)')
+    group.add_argument('-a', dest='a', type=str, help='Archive to append the input files to, as a new segment, without recompressing it (created if missing)')
+    group.add_argument('--train', type=str, default=None, help='Output file of a preset dictionary trained on the input files')
 
     parser.add_argument('-e', '--encrypt', type=int, default=None, help='Integer encryption key (Default: no encryption)')
+    parser.add_argument('--cipher', type=str, default='random', choices=['random', 'keystream'], help='Encryption scheme: per-code offsets from the random module, or a batched SHAKE-256 keystream that is faster and the same on every Python version (Default: random)')
     parser.add_argument('-t', '--text', type=str, default='none', choices=['none', 'hex', 'base64'], help='Binary-to-text encoding scheme used (Default: no binary-to-text)')
     parser.add_argument('-v', '--variable', default=argparse.SUPPRESS, action='store_true', help='Whether variable-width code is used (Default: no)')
-
-    return parser.parse_args(), parser.print_help
+    parser.add_argument('--bits', type=int, default=None, help='Code size of fixed-width code, or the largest code size of variable-width code, from 9 to 24; larger dictionaries trade memory for ratio, and are stored compactly from 20 bits; recorded in the header (Default: 12, or 16 with -v)')
+    parser.add_argument('--variant', type=str, default='lzw', choices=['lzw', 'lzmw', 'lzap'], help='Dictionary variant: classic LZW, or LZMW and LZAP, which add entries made of the previous and current matches and always use variable-width code; recorded in the header (Default: lzw)')
+    parser.add_argument('--preset', type=str, default=None, help='Preset dictionary made with --train that every fresh dictionary starts with, for small files like the training ones; its digest is recorded in the header, and it has to be given again to decompress (Default: none)')
+    parser.add_argument('--preset-size', dest='preset_size', type=int, default=1024, help=f'Number of entries of the preset dictionary made with --train, at most {PresetDictionary.MAX_ENTRIES} (Default: 1024)')
+    parser.add_argument('--clear', action='store_true', help='Freeze the full dictionary and reset it with a CLEAR code only when the compression ratio drops, like Unix compress (Default: reset as soon as it is full)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes; compresses each input file independently (Default: single stream)')
+    parser.add_argument('-b', '--block-size', dest='block_size', type=int, default=None, help='Split every input file into independently compressed blocks of this many bytes, compressed in parallel (Default: no blocks)')
+    parser.add_argument('-x', '--extract', type=str, nargs='+', default=None, help='Names of the files to extract when decompressing (Default: all files)')
+    parser.add_argument('--test', action='store_true', help='Decompress the archive without writing any file, checking the CRC32 of every file stored with --crc (Default: no)')
+    parser.add_argument('--crc', action='store_true', help='Store the CRC32 of every file, or of every block with -b, to be checked when decompressing; recorded in the header (Default: no)')
+    parser.add_argument('--no-dedup', dest='dedup', action='store_false', help='Compress every copy of identical input files, instead of storing the later copies as references to the first (Default: deduplicate)')
+    parser.add_argument('--mmap', action='store_true', help='Read input files, and write output files of known size (-j archives), through mmap (Default: no)')
+    parser.add_argument('--low-memory', dest='low_memory', action='store_true', help='Decompress with compact array-backed dictionary tables, slower but using far less memory (Default: no)')
+    parser.add_argument('--stats', type=str, nargs='?', const=STDIO_NAME, default=None, help='Print statistics of the compression as JSON, or write them to the given file (Default: no statistics)')
+
+    opt = parser.parse_args()
+    # *LZMW and LZAP always use variable-width code and reset when full
+    if opt.variant != 'lzw' and ('variable' in opt or opt.clear):
+        parser.error(f'--variant {opt.variant} cannot be combined with -v or --clear')
+    # *a block or a worker count below one would make empty archives or fail deep in the pool
+    for name, value in (('-j/--jobs', opt.jobs), ('-b/--block-size', opt.block_size)):
+        if value is not None and value < 1:
+            parser.error(f'{name} must be at least 1, not {value}')
+    return opt, parser.print_help
 
 def dict_limit(N_BITS):
     return 2**N_BITS-1
+
+'''
+    *Code size of a fresh dictionary: MIN_BITS, or wider if a preset dictionary does not fit in it
+'''
+def start_bits(coder)->int:
+    code_size = coder.MIN_BITS
+    while len(coder.DICT) >= dict_limit(code_size)-1:
+        code_size += 1
+    return code_size
 '''
     Encryption
 '''
@@ -31,7 +77,11 @@ class EncryptedLZWWriter(BaseLZWWriter):
         self.parent_writer = parent_writer
         self.encrypt_key = encrypt_key
         self.name = self.parent_writer.name
+        self.code_size = parent_writer.code_size
         self.dict_limit = dict_limit(parent_writer.code_size)
+        # *a generator of its own instead of the global one of the random module, so that writers in
+        # concurrent threads do not draw each other's offsets; seeded alike, it gives the same offsets
+        self.random = random.Random()
 
     def set_code_size(self, code_size: int):
         super().set_code_size(code_size)
@@ -43,7 +93,7 @@ class EncryptedLZWWriter(BaseLZWWriter):
     '''
     def initialize(self):
         if self.encrypt_key:
-            random.seed(self.encrypt_key)
+            self.random.seed(self.encrypt_key)
 
     '''
         Read a code of size CODE_SIZE from the input file
@@ -53,7 +103,7 @@ class EncryptedLZWWriter(BaseLZWWriter):
         code = self.parent_writer.read_code()
         # process code
         if self.encrypt_key and code is not None:
-            code += random.randint(0, self.dict_limit+1)
+            code += self.random.randint(0, self.dict_limit+1)
             code %= self.dict_limit+1
             pass
         return code
@@ -66,7 +116,7 @@ class EncryptedLZWWriter(BaseLZWWriter):
         # process code
         if self.encrypt_key:
             code += self.dict_limit+1
-            code -= random.randint(0, self.dict_limit+1)
+            code -= self.random.randint(0, self.dict_limit+1)
             code %= self.dict_limit+1
             pass
         self.parent_writer.write_code(code)
@@ -74,6 +124,44 @@ class EncryptedLZWWriter(BaseLZWWriter):
     def flush(self):
         self.parent_writer.flush()
 
+    def align_output(self):
+        self.parent_writer.align_output()
+
+    def align_input(self):
+        self.parent_writer.align_input()
+
+    def read_bytes(self, n):
+        return self.parent_writer.read_bytes(n)
+
+    def skip_bytes(self, n):
+        self.parent_writer.skip_bytes(n)
+
+    def write_bytes(self, data):
+        self.parent_writer.write_bytes(data)
+
+    def read_codes(self, n):
+        codes = self.parent_writer.read_codes(n)
+        # process codes
+        if self.encrypt_key:
+            if np is not None and isinstance(codes, np.ndarray):
+                codes = codes.tolist()
+            randint = self.random.randint
+            codes = [(code + randint(0, self.dict_limit+1)) % (self.dict_limit+1) for code in codes]
+        return codes
+
+    def write_codes(self, codes):
+        # process codes
+        if self.encrypt_key:
+            randint = self.random.randint
+            codes = [(code + self.dict_limit+1 - randint(0, self.dict_limit+1)) % (self.dict_limit+1) for code in codes]
+        self.parent_writer.write_codes(codes)
+
+    '''
+        *Random offset in [0, n] used to encrypt a character of the file names
+    '''
+    def name_offset(self, n):
+        return self.random.randint(0, n)
+
     '''
         *Offset function that performs encryption on the file names.
         TODO: prevent encoding to value b'' and b'\n'
@@ -84,7 +172,7 @@ class EncryptedLZWWriter(BaseLZWWriter):
 
         char = ord(char)
         char += MAX_VALID_CODE
-        char += sign*(MIN_VALID_CODE+random.randint(0, MAX_VALID_CODE))
+        char += sign*(MIN_VALID_CODE+self.name_offset(MAX_VALID_CODE))
         char %= MAX_VALID_CODE
         char = chr(char)
 
@@ -115,156 +203,230 @@ class EncryptedLZWWriter(BaseLZWWriter):
         self.parent_writer.write_file_header(input_file_names)
 
 '''
-    Binary-to-text Encoding
+    *Encryption with a keystream instead of the global random module
+    The offsets are 32-bit words of SHAKE-256 over the key and a batch counter, generated BATCH_SIZE at a time,
+    so archives decode the same on every Python version and whole arrays of codes are encrypted at once.
+    The file header is not shifted character by character: its UTF-8 bytes are XORed with a SHAKE-256 stream
+    of its own and stored as one line of hex digits, which is valid UTF-8 and never split by a newline.
 '''
-class HexLZWWriter(LZWWriter):
+class KeystreamLZWWriter(EncryptedLZWWriter):
+    BATCH_SIZE = 2**16 # number of offsets generated at a time
 
-    def __init__(self, file, code_size=CODE_SIZE):
-        super(HexLZWWriter, self).__init__(file, code_size)
+    def __init__(self, parent_writer:LZWWriter, encrypt_key=None):
+        super(KeystreamLZWWriter, self).__init__(parent_writer, encrypt_key)
+        self.initialize()
+
+    '''
+        Reset internal state
+    '''
+    def initialize(self):
+        self.batch_index = 0
+        self.keystream = []
+        self.key_pos = 0
+
+    def keystream_batch(self, index):
+        data = hashlib.shake_256(f'lzw-keystream:{self.encrypt_key}:{index}'.encode('ascii')).digest(4*self.BATCH_SIZE)
+        if np is not None:
+            return np.frombuffer(data, dtype='<u4').astype(np.int64)
+        words = array('I', data)
+        if sys.byteorder == 'big':
+            words.byteswap()
+        return words
+
+    def next_batch(self):
+        self.keystream = self.keystream_batch(self.batch_index)
+        self.batch_index += 1
+        self.key_pos = 0
+
+    '''
+        Return the next n offsets of the keystream
+    '''
+    def offsets(self, n):
+        batches = []
+        while n > 0:
+            if self.key_pos >= len(self.keystream):
+                self.next_batch()
+            batch = self.keystream[self.key_pos:self.key_pos+n]
+            self.key_pos += len(batch)
+            n -= len(batch)
+            batches.append(batch)
+        if len(batches) == 1:
+            return batches[0]
+        return np.concatenate(batches) if np is not None else sum(batches, array(batches[0].typecode))
+
+    def next_offset(self):
+        if self.key_pos >= len(self.keystream):
+            self.next_batch()
+        offset = self.keystream[self.key_pos]
+        self.key_pos += 1
+        return int(offset)
 
     def read_code(self):
-        read_code = self
-        input_file = self.file
-
-        if not hasattr(read_code, 'buffer'):
-            read_code.buffer = 0
-            read_code.buffer_bit_count = 0
-        while read_code.buffer_bit_count < self.code_size:
-            input_byte = input_file.read(2) # read 2 bytes together
-            if input_byte == b'':
-                return None
-            read_code.buffer <<= 8
-            read_code.buffer |= int.from_bytes(bytes.fromhex(input_byte.decode('ascii')), 'big') # from hex
-            read_code.buffer_bit_count += 8
-        read_code.buffer_bit_count -= self.code_size
-        code = read_code.buffer >> read_code.buffer_bit_count
-        read_code.buffer &= (1 << read_code.buffer_bit_count) - 1
+        code = self.parent_writer.read_code()
+        if self.encrypt_key and code is not None:
+            code = (code + self.next_offset()) % (self.dict_limit+1)
         return code
 
     def write_code(self, code):
-        write_code = self
-        output_file = self.file
-
-        if not hasattr(write_code, 'buffer'):
-            write_code.buffer = 0
-            write_code.buffer_bit_count = 0
-        write_code.buffer <<= self.code_size
-        write_code.buffer |= code
-        write_code.buffer_bit_count += self.code_size # the remaining number of bits in the buffer
-        while write_code.buffer_bit_count >= 8:
-            write_code.buffer_bit_count -= 8
-            output_byte = (write_code.buffer >> write_code.buffer_bit_count)
-            output_byte &= 0xFF
-            output_file.write(output_byte.to_bytes(1, 'big').hex().encode()) # to hex
-            write_code.buffer &= (1 << write_code.buffer_bit_count) - 1
-        return
+        if self.encrypt_key:
+            code = (code - self.next_offset()) % (self.dict_limit+1)
+        self.parent_writer.write_code(code)
 
-    def read_file_header(self):
-        input_file = self.file
+    def read_codes(self, n):
+        codes = self.parent_writer.read_codes(n)
+        if self.encrypt_key and len(codes) > 0:
+            offsets = self.offsets(len(codes))
+            if np is not None:
+                codes = (np.asarray(codes, dtype=np.int64) + offsets) % (self.dict_limit+1)
+            else:
+                codes = [(code + offset) % (self.dict_limit+1) for code, offset in zip(codes, offsets)]
+        return codes
+
+    def write_codes(self, codes):
+        if self.encrypt_key and len(codes) > 0:
+            offsets = self.offsets(len(codes))
+            if np is not None:
+                codes = (np.asarray(codes, dtype=np.int64) - offsets) % (self.dict_limit+1)
+            else:
+                codes = [(code - offset) % (self.dict_limit+1) for code, offset in zip(codes, offsets)]
+        self.parent_writer.write_codes(codes)
 
-        NUL, NL = b'', b'\n'
-        NUL, NL = NUL.hex().encode('ascii'), NL.hex().encode('ascii')
-        output_file_names = []
+    '''
+        *XOR data with the keystream of the header, which is its own inverse
+    '''
+    def header_cipher(self, data:bytes)->bytes:
+        keystream = hashlib.shake_256(f'lzw-keystream-header:{self.encrypt_key}'.encode('ascii')).digest(len(data))
+        return (int.from_bytes(data, 'big') ^ int.from_bytes(keystream, 'big')).to_bytes(len(data), 'big')
 
-        line = b''
-        while True:
-            char = input_file.read(2)
-            line += char
-            if line == NUL or line == NL or line == b'':
-                break
-            if char == NL:
-                output_file_names.append(bytes.fromhex(line.decode('ascii')).decode('utf-8').strip())
-                line = b''
+    def read_file_header(self):
+        self.initialize()
+        output_file_names = self.parent_writer.read_file_header()
+        if self.encrypt_key:
+            header = self.header_cipher(bytes.fromhex(''.join(output_file_names)))
+            # a wrong key gives garbled names, and the codes then fail to decode
+            output_file_names = header.decode('utf-8', errors='replace').split('\n')
         return output_file_names
 
-    def write_file_header(self, input_file_names:list[str]):
-        output_file = self.file
+    def write_file_header(self, input_file_names):
+        self.initialize()
+        if self.encrypt_key:
+            input_file_names = [self.header_cipher('\n'.join(input_file_names).encode('utf-8')).hex()]
+        self.parent_writer.write_file_header(input_file_names)
 
-        NUL, NL = b'', b'\n'
-        NUL, NL = NUL.hex().encode('ascii'), NL.hex().encode('ascii')
-        for input_file_name in input_file_names:
-            output_file.write(input_file_name.encode('utf-8').hex().encode('ascii') + NL)
-        output_file.write(NL)
-        return
+ENCRYPTORS = {'random':EncryptedLZWWriter, 'keystream':KeystreamLZWWriter}
+
+'''
+    Binary-to-text Encoding
 
+    *Hex archives are the hex digits of the binary ones, so codes and headers are packed in binary by LZWWriter
+    and whole blocks are transcoded with binascii on their way to and from the file.
+    Raw bytes (members and block prefixes) are hex digits themselves and go through the same transcoding.
+'''
+class HexLZWWriter(LZWWriter):
+
+    def __init__(self, file, code_size=CODE_SIZE):
+        super(HexLZWWriter, self).__init__(file, code_size)
+        self.odd_digit = b'' # *a digit read without the other one of its byte, from a stream that is not complete yet
+
+    def fill_input(self):
+        data = self.odd_digit + self.file.read(2*CHUNK_SIZE)
+        if len(data) % 2 == 1:
+            data += self.file.read(1)
+        data, self.odd_digit = data[:len(data) // 2 * 2], data[len(data) // 2 * 2:]
+        self.in_chunk = binascii.unhexlify(data) # from hex
+        self.in_pos = 0
+        return len(self.in_chunk) > 0
+
+    def flush_output(self):
+        if self.out_chunk:
+            self.file.write(binascii.hexlify(self.out_chunk)) # to hex
+            self.out_chunk = bytearray()
+
+    def write_bytes(self, data):
+        super().write_bytes(binascii.unhexlify(data))
+
+    def read_bytes(self, n):
+        return binascii.hexlify(self.read_buffer(n // 2))
+
+    def skip_bytes(self, n):
+        n //= 2
+        available = len(self.in_chunk) - self.in_pos
+        if n <= available:
+            self.in_pos += n
+        elif self.file.seekable():
+            self.file.seek(2*(n - available), os.SEEK_CUR)
+            self.in_chunk, self.in_pos = b'', 0
+        else:
+            self.read_buffer(n)
+
+'''
+    *Base64 archives are the bit stream of the binary ones cut into unpadded 6-bit groups, so LZWWriter packs
+    the codes into 6-bit units and whole blocks are mapped to and from characters with 64-entry translation tables.
+    Raw bytes (members and block prefixes) are base64 characters themselves and go through the same tables.
+'''
 class Base64LZWWriter(LZWWriter):
+    UNIT_BITS = 6
     
     std_base64chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+    ENCODE_TABLE = bytes.maketrans(bytes(range(64)), std_base64chars.encode('ascii'))
+    DECODE_TABLE = bytes.maketrans(std_base64chars.encode('ascii'), bytes(range(64)))
 
     def __init__(self, file, code_size=CODE_SIZE):
-        self.file = file
-        self.name = file.name
-        self.code_size = code_size
+        super(Base64LZWWriter, self).__init__(file, code_size)
 
-    def read_code(self):
-        read_code = self
-        input_file = self.file
-
-        if not hasattr(read_code, 'buffer'):
-            read_code.buffer = 0
-            read_code.buffer_bit_count = 0
-        while read_code.buffer_bit_count < self.code_size:
-            input_byte = input_file.read(1)
-            if input_byte == b'':
-                return None
-            input_byte = self.std_base64chars.find(input_byte.decode('ascii')) # base64 inverse mapping
-            read_code.buffer <<= 6
-            read_code.buffer |= input_byte
-            read_code.buffer_bit_count += 6
-        read_code.buffer_bit_count -= self.code_size
-        code = read_code.buffer >> read_code.buffer_bit_count
-        read_code.buffer &= (1 << read_code.buffer_bit_count) - 1
-        return code
+    def fill_input(self):
+        self.in_chunk = self.file.read(CHUNK_SIZE).translate(self.DECODE_TABLE) # base64 inverse mapping
+        self.in_pos = 0
+        return len(self.in_chunk) > 0
 
-    def write_code(self, code):
-        write_code = self
-        output_file = self.file
-
-        if not hasattr(write_code, 'buffer'):
-            write_code.buffer = 0
-            write_code.buffer_bit_count = 0
-        write_code.buffer <<= self.code_size
-        write_code.buffer |= code
-        write_code.buffer_bit_count += self.code_size
-        while write_code.buffer_bit_count >= 6:
-            write_code.buffer_bit_count -= 6
-            output_byte = (write_code.buffer >> write_code.buffer_bit_count)
-            output_byte &= 0x3F # 6 bits
-            output_byte = self.std_base64chars[output_byte].encode('ascii') # base64 mapping
-            output_file.write(output_byte)
-            write_code.buffer &= (1 << write_code.buffer_bit_count) - 1
-        return
+    def flush_output(self):
+        if self.out_chunk:
+            self.file.write(self.out_chunk.translate(self.ENCODE_TABLE)) # base64 mapping
+            self.out_chunk = bytearray()
 
-    def read_file_header(self):
-        code_size = self.code_size
-        self.code_size = 8
+    def write_bytes(self, data):
+        super().write_bytes(bytes(data).translate(self.DECODE_TABLE))
 
-        NUL, NL = b'', b'\n'
+    def read_bytes(self, n):
+        return self.read_buffer(n).translate(self.ENCODE_TABLE)
 
-        output_file_names = []
-        
-        line = b''
+    '''
+        *The header starts the stream, so it is decoded 3 bytes per 4 characters with binascii until its end is found,
+        and the code after it starts in the middle of a character
+    '''
+    def read_file_header(self):
+        units = bytearray(self.in_chunk[self.in_pos:])
+        more = True
         while True:
-            char = bytes([self.read_code()])
-            line += char
-            if line == NUL or line == NL:
+            # only whole groups of 4 characters are decoded, unless the end of the file is reached
+            groups = bytes(units if not more else units[:len(units) // 4 * 4])
+            header = binascii.a2b_base64(groups.translate(self.ENCODE_TABLE) + b'A'*(-len(groups) % 4))
+            end = 1 if header.startswith(b'\n') else header.find(b'\n\n') + 2
+            if end > 1 or header.startswith(b'\n'):
+                break
+            if not more:
+                end = len(header)
                 break
-            if char == NL:
-                output_file_names.append(line.decode('utf-8').strip())
-                line = b''
+            more = self.fill_input()
+            units += self.in_chunk
 
-        self.code_size = code_size
+        # continue reading right after the header, which may end in the middle of a character
+        header_units, header_bits = divmod(8*end, self.UNIT_BITS)
+        self.in_chunk, self.in_pos = bytes(units), min(header_units, len(units))
+        self.buffer = self.buffer_bit_count = 0
+        if header_bits > 0 and header_units < len(units):
+            self.buffer_bit_count = self.UNIT_BITS - header_bits
+            self.buffer = units[header_units] & ((1 << self.buffer_bit_count) - 1)
+            self.in_pos += 1
 
-        return output_file_names
+        return [line.decode('utf-8', 'surrogatepass').strip() for line in header[:end].split(b'\n')[:-1] if line]
 
     def write_file_header(self, input_file_names):
         code_size = self.code_size
         self.code_size = 8
 
-        for input_file_name in input_file_names:
-            for c in input_file_name.encode('utf-8') + b'\n':
-                self.write_code(c)
-        self.write_code(ord(b'\n'.decode('utf-8')))
+        header = b''.join(input_file_name.encode('utf-8', 'surrogatepass') + b'\n' for input_file_name in input_file_names) + b'\n'
+        self.write_codes(list(header))
 
         self.code_size = code_size
         return
@@ -272,186 +434,1493 @@ class Base64LZWWriter(LZWWriter):
 '''
     Variable-width Code
 '''
-class VariableWidthLZWProcessor(LZWProcessor):
-    N_BITS = 8
+class VariableWidthLZWCompressor(LZWCompressor):
     MIN_BITS = 9
     MAX_BITS = 16
-    CUR_DICT_LIMIT = 2**8-1
-    EOF = CUR_DICT_LIMIT
-    
-    @classmethod
-    def update_code_size(cls, writer:BaseLZWWriter, code_size:int):
-        cls.N_BITS = code_size
-        cls.EOF = cls.CUR_DICT_LIMIT = dict_limit(code_size)
-        writer.set_code_size(cls.N_BITS)
+
+    def __init__(self, writer:BaseLZWWriter=None, stats:LZWStats=None, max_bits:int=None, preset=None):
+        super(VariableWidthLZWCompressor, self).__init__(writer, stats, max_bits, preset)
+        self.START_BITS = start_bits(self)
+        self.update_code_size(self.START_BITS)
+
+    def update_code_size(self, code_size:int):
+        self.N_BITS = code_size
+        self.EOF = self.CUR_DICT_LIMIT = dict_limit(code_size)
+        self.writer.set_code_size(self.N_BITS)
+
+    def feed(self, chunk)->bytes:
+        lzw_dict, DICT, codes = self.lzw_dict, self.DICT, self.codes
+        chars = iter(chunk)
+        STRING = self.STRING
+        if STRING is None:
+            STRING = next(chars, None)
+        for CHAR in chars:
+            KEY = (STRING << 8) | CHAR
+            if KEY in DICT:
+                STRING = DICT[KEY]
+            else:
+                codes.append(STRING)
+                # codes are written in bulk, until the code size changes
+                if len(DICT) >= self.CUR_DICT_LIMIT or len(codes) >= CHUNK_SIZE:
+                    self.write_codes()
+                if len(DICT) >= self.CUR_DICT_LIMIT: # To cater for variable-width code
+                    self.width_changes += 1
+                    if self.N_BITS < self.MAX_BITS:
+                        self.update_code_size(self.N_BITS+1)
+                        lzw_dict.update_dict_comp(DICT, len(DICT), KEY)
+                    else:
+                        lzw_dict.init_dict_comp(DICT) 
+                        self.update_code_size(self.START_BITS)
+                        self.resets += 1
+                else:
+                    lzw_dict.update_dict_comp(DICT, len(DICT), KEY)
+                STRING = CHAR
+        self.STRING = STRING
+        return self.drain()
+
+class VariableWidthLZWDecompressor(LZWDecompressor):
+    MIN_BITS = VariableWidthLZWCompressor.MIN_BITS
+    MAX_BITS = VariableWidthLZWCompressor.MAX_BITS
+
+    def __init__(self, reader:BaseLZWWriter=None, writer:FilesWriter=None, members:int=1, lzw_dict:LZWDict=None, max_bits:int=None, preset=None):
+        super(VariableWidthLZWDecompressor, self).__init__(reader, writer, members, lzw_dict, max_bits, preset)
+        self.START_BITS = start_bits(self)
+        self.update_code_size(self.START_BITS)
+
+    def update_code_size(self, code_size:int):
+        self.N_BITS = code_size
+        self.EOF = self.CUR_DICT_LIMIT = dict_limit(code_size)
+        self.reader.set_code_size(self.N_BITS)
+
+    def decode(self):
+        lzw_dict, DICT, out, writer, reader = self.lzw_dict, self.DICT, self.out, self.writer, self.reader
+        CURRENT, i, pos = self.CURRENT, self.i, 0
+        if i >= self.members:
+            return
+
+        for NEXT in iter(reader.read_code, None):
+            if CURRENT is None:
+                if NEXT == self.EOF: # empty member
+                    writer.write(i, b'')
+                    i += 1
+                    if i >= self.members: break
+                else:
+                    CURRENT = NEXT
+                continue
+            pos = lzw_dict.expand(DICT, CURRENT, out, pos)
+            if NEXT == self.EOF: 
+                writer.write(i, memoryview(out)[:pos])
+                pos = 0
+                CURRENT = None
+                i += 1
+                if i >= self.members: break
+                continue
+            if pos >= CHUNK_SIZE:
+                writer.write(i, memoryview(out)[:pos])
+                pos = 0
+            if NEXT in DICT:
+                CHAR = lzw_dict.first_char(DICT, NEXT)
+            else:
+                CHAR = lzw_dict.first_char(DICT, CURRENT)
+            if len(DICT) >= self.CUR_DICT_LIMIT-1: # To cater for variable-width code
+                if self.N_BITS < self.MAX_BITS:
+                    self.update_code_size(self.N_BITS+1)
+                    lzw_dict.append_dict_decomp(DICT, len(DICT), CURRENT, CHAR)
+                else:
+                    # Write the string first; it may be the last entry, added just before the reset
+                    lzw_dict.append_dict_decomp(DICT, len(DICT), CURRENT, CHAR)
+                    pos = lzw_dict.expand(DICT, NEXT, out, pos)
+                    # Reset the dictionary
+                    lzw_dict.init_dict_decomp(DICT)
+                    self.update_code_size(self.START_BITS)
+                    # The next code starts afresh
+                    CURRENT = None
+                    continue
+            else:
+                lzw_dict.append_dict_decomp(DICT, len(DICT), CURRENT, CHAR)
+            CURRENT = NEXT
+
+        if pos > 0:
+            writer.write(i, memoryview(out)[:pos])
+        self.CURRENT, self.i = CURRENT, i
+
+class VariableWidthLZWProcessor(LZWProcessor):
+    COMPRESSOR = VariableWidthLZWCompressor
+    DECOMPRESSOR = VariableWidthLZWDecompressor
+
+'''
+    *CLEAR-code mode, like Unix compress
+    Once the dictionary is full it is frozen instead of reset, and the ratio of the whole input so far is checked
+    every CHECK_GAP bytes. When it stops improving, an explicit CLEAR code (the code below EOF at MAX_BITS,
+    which is never used for an entry) tells the decompressor to reset the dictionary as well.
+'''
+class VariableWidthClearCodeLZWCompressor(VariableWidthLZWCompressor):
+    CHECK_GAP = 1000 # input bytes between two checks of the ratio
+
+    def __init__(self, writer:BaseLZWWriter=None, stats:LZWStats=None, max_bits:int=None, preset=None):
+        self.bytes_in = 0
+        self.checkpoint = 0 # input position of the next check of the ratio
+        self.ratio = None # ratio at the last check, None after a reset
+        super(VariableWidthClearCodeLZWCompressor, self).__init__(writer, stats, max_bits, preset)
+
+    def update_code_size(self, code_size:int):
+        super().update_code_size(code_size)
+        if code_size == self.MAX_BITS:
+            self.CLEAR = self.CUR_DICT_LIMIT = self.EOF-1
 
     '''
-        Implement your LZW compression
-        You can choose to process one file in one function call or all files together
+        Return whether the ratio of the input so far is no better than at the last check
     '''
-    @classmethod
-    def compress(cls, writer:LZWWriter, input_file_names):
-        print(f"\nCompressing {', '.join(input_file_names)} into {writer.name}")
+    def ratio_degraded(self, position)->bool:
+        ratio = position / max(self.bits_written + len(self.codes)*self.N_BITS, 1)
+        self.checkpoint = position + self.CHECK_GAP
+        if self.ratio is None or ratio > self.ratio:
+            self.ratio = ratio
+            return False
+        self.ratio = None
+        return True
+
+    def feed(self, chunk)->bytes:
+        lzw_dict, DICT, codes = self.lzw_dict, self.DICT, self.codes
+        chars = iter(chunk)
+        STRING = self.STRING
+        position = self.bytes_in # position of CHAR in the input
+        if STRING is None:
+            STRING = next(chars, None)
+            position += 1
+        for position, CHAR in enumerate(chars, position):
+            KEY = (STRING << 8) | CHAR
+            if KEY in DICT:
+                STRING = DICT[KEY]
+            else:
+                codes.append(STRING)
+                if len(DICT) >= self.CUR_DICT_LIMIT:
+                    if self.N_BITS < self.MAX_BITS:
+                        self.write_codes()
+                        self.width_changes += 1
+                        self.update_code_size(self.N_BITS+1)
+                        lzw_dict.update_dict_comp(DICT, len(DICT), KEY)
+                    elif position >= self.checkpoint and self.ratio_degraded(position):
+                        codes.append(self.CLEAR)
+                        self.write_codes()
+                        lzw_dict.init_dict_comp(DICT)
+                        if self.MIN_BITS < self.MAX_BITS:
+                            self.width_changes += 1
+                            self.update_code_size(self.START_BITS)
+                        self.resets += 1
+                else:
+                    lzw_dict.update_dict_comp(DICT, len(DICT), KEY)
+                if len(codes) >= CHUNK_SIZE:
+                    self.write_codes()
+                STRING = CHAR
+        self.STRING = STRING
+        self.bytes_in += len(chunk)
+        return self.drain()
+
+class VariableWidthClearCodeLZWDecompressor(VariableWidthLZWDecompressor):
+    MIN_BITS = VariableWidthClearCodeLZWCompressor.MIN_BITS
+    MAX_BITS = VariableWidthClearCodeLZWCompressor.MAX_BITS
+
+    def update_code_size(self, code_size:int):
+        super().update_code_size(code_size)
+        self.CLEAR = self.EOF-1 if code_size == self.MAX_BITS else None
+
+    def decode(self):
+        lzw_dict, DICT, out, writer, reader = self.lzw_dict, self.DICT, self.out, self.writer, self.reader
+        CURRENT, i, pos = self.CURRENT, self.i, 0
+        if i >= self.members:
+            return
+        FULL = dict_limit(self.MAX_BITS)-1 # the dictionary is frozen at this size
+
+        # codes are read in bulk if their size never changes
+        codes = reader.iter_codes() if self.MIN_BITS == self.MAX_BITS else iter(reader.read_code, None)
+        for NEXT in codes:
+            if CURRENT is None:
+                if NEXT == self.EOF: # empty member
+                    writer.write(i, b'')
+                    i += 1
+                    if i >= self.members: break
+                else:
+                    CURRENT = NEXT
+                continue
+            pos = lzw_dict.expand(DICT, CURRENT, out, pos)
+            if NEXT == self.EOF: 
+                writer.write(i, memoryview(out)[:pos])
+                pos = 0
+                CURRENT = None
+                i += 1
+                if i >= self.members: break
+                continue
+            if pos >= CHUNK_SIZE:
+                writer.write(i, memoryview(out)[:pos])
+                pos = 0
+            if NEXT == self.CLEAR:
+                lzw_dict.init_dict_decomp(DICT)
+                self.update_code_size(self.START_BITS)
+                # The next code starts afresh
+                CURRENT = None
+                continue
+            if len(DICT) < FULL:
+                if NEXT in DICT:
+                    CHAR = lzw_dict.first_char(DICT, NEXT)
+                else:
+                    CHAR = lzw_dict.first_char(DICT, CURRENT)
+                if len(DICT) >= self.CUR_DICT_LIMIT-1 and self.N_BITS < self.MAX_BITS: # To cater for variable-width code
+                    self.update_code_size(self.N_BITS+1)
+                lzw_dict.append_dict_decomp(DICT, len(DICT), CURRENT, CHAR)
+            CURRENT = NEXT
 
-        lzw_dict = LZWDict()
-        DICT = lzw_dict.init_dict_comp(dict())
-        writer.initialize()
+        if pos > 0:
+            writer.write(i, memoryview(out)[:pos])
+        self.CURRENT, self.i = CURRENT, i
 
-        cls.update_code_size(writer, cls.MIN_BITS)
+class VariableWidthClearCodeLZWProcessor(LZWProcessor):
+    COMPRESSOR = VariableWidthClearCodeLZWCompressor
+    DECOMPRESSOR = VariableWidthClearCodeLZWDecompressor
+    CLEAR = True
+
+'''
+    *CLEAR-code mode with fixed-width codes of CODE_SIZE bits
+'''
+class ClearCodeLZWCompressor(VariableWidthClearCodeLZWCompressor):
+    MIN_BITS = MAX_BITS = CODE_SIZE
+
+class ClearCodeLZWDecompressor(VariableWidthClearCodeLZWDecompressor):
+    MIN_BITS = MAX_BITS = CODE_SIZE
+
+class ClearCodeLZWProcessor(LZWProcessor):
+    COMPRESSOR = ClearCodeLZWCompressor
+    DECOMPRESSOR = ClearCodeLZWDecompressor
+    CLEAR = True
+
+'''
+    *LZMW and LZAP
+    A new entry is made from the previous match P and the current match M: LZMW adds P+M, and LZAP adds P+M[:k]
+    for every k, so long repeats are learnt in a few matches instead of one byte at a time.
+    The compressor finds the longest matches in a trie of the entries; both sides add the same entries right after
+    every match, except strings longer than MAX_STRING_SIZE. LZMW entries may repeat a string, which saves
+    the decompressor from keeping a trie, while LZAP, which adds many short prefixes, skips the strings already in
+    the dictionary, so its decompressor keeps the trie too.
+    Codes are variable-width, growing with the dictionary, which is reset when full.
+'''
+class LZMWTable:
+    MAX_STRING_SIZE = 2**12
+
+    def __init__(self, max_bits:int, keep_strings:bool=False):
+        self.limit = dict_limit(max_bits)
+        self.TRIE = dict()   # (node << 8) | char -> child node
+        self.CODE = []       # node -> code, or -1 if its string is not an entry
+        self.LENGTH = []     # node -> length of its string
+        self.NODE = []       # code -> node
+        self.STRINGS = [] if keep_strings else None # code -> string, for decompression
+        self.reset()
+
+    def __len__(self)->int:
+        return len(self.NODE) if self.STRINGS is None else len(self.STRINGS)
+
+    # *the lists are cleared in place, so that the coders can keep references to them
+    def reset(self):
+        self.TRIE.clear()
+        self.CODE[:] = range(256)
+        self.LENGTH[:] = [1]*256
+        self.NODE[:] = range(256)
+        if self.STRINGS is not None:
+            self.STRINGS[:] = [bytes([char]) for char in range(256)]
+        self.previous = None # code of the previous match, None at the start of a member
 
-        for input_file_name in input_file_names:
-            STRING, CHAR = None, None
-            with open(input_file_name, 'rb') as input_file:
-                print(f"\tCompressing {input_file.name} ...")
-                if STRING is None:
-                    STRING = input_file.read(1)
-                while True:
-                    CHAR = input_file.read(1)
-                    if CHAR == b'': break
-                    if STRING+CHAR in DICT:
-                        STRING += CHAR
-                    else:
-                        writer.write_code(DICT[STRING])
-                        if len(DICT) >= cls.CUR_DICT_LIMIT: # To cater for variable-width code
-                            if cls.N_BITS < cls.MAX_BITS:
-                                cls.update_code_size(writer, cls.N_BITS+1)
-                                lzw_dict.update_dict_comp(DICT, len(DICT), STRING+CHAR)
-                            else:
-                                lzw_dict.init_dict_comp(DICT) 
-                                cls.update_code_size(writer, cls.MIN_BITS)
-                        else:
-                            lzw_dict.update_dict_comp(DICT, len(DICT), STRING+CHAR)
-                        STRING = CHAR
-                writer.write_code(DICT[STRING])
-                writer.write_code(cls.EOF)
-            
-        writer.write_code(EOF)
-        writer.flush()
-
-        print("\tDone.")
-
-    '''
-        Implement your LZW decompression
-        You can choose to process one file in one function call or all files together
     '''
+        *Add P+M; the compressor walks down the trie from the node of P along M, adding missing nodes,
+        and a repeated string keeps its first code
+    '''
+    def add(self, previous:int, match:bytes):
+        if self.STRINGS is not None:
+            string = self.STRINGS[previous] + match
+            if len(string) <= self.MAX_STRING_SIZE and len(self.STRINGS) < self.limit:
+                self.STRINGS.append(string)
+            return
+
+        TRIE, CODE, LENGTH = self.TRIE, self.CODE, self.LENGTH
+        node = self.NODE[previous]
+        if LENGTH[node] + len(match) > self.MAX_STRING_SIZE or len(self.NODE) >= self.limit:
+            return
+        for char in match:
+            key = (node << 8) | char
+            child = TRIE.get(key)
+            if child is None:
+                child = TRIE[key] = len(CODE)
+                CODE.append(-1)
+                LENGTH.append(LENGTH[node]+1)
+            node = child
+        if CODE[node] < 0:
+            CODE[node] = len(self.NODE)
+        self.NODE.append(node)
+
+    '''
+        *Add the entries of the previous match and this one; return whether the full dictionary was reset
+    '''
+    def update(self, code:int, match:bytes)->bool:
+        if self.previous is not None:
+            self.add(self.previous, match)
+        self.previous = code
+        if len(self) >= self.limit:
+            self.reset()
+            return True
+        return False
+
+class LZAPTable(LZMWTable):
+    '''
+        *Add P+M[:k] for every k that is not already an entry, walking down the trie on both sides
+    '''
+    def add(self, previous:int, match:bytes):
+        TRIE, CODE, LENGTH, NODE, STRINGS = self.TRIE, self.CODE, self.LENGTH, self.NODE, self.STRINGS
+        node = NODE[previous]
+        if LENGTH[node] + len(match) > self.MAX_STRING_SIZE:
+            match = match[:self.MAX_STRING_SIZE - LENGTH[node]]
+        for k, char in enumerate(match, 1):
+            key = (node << 8) | char
+            child = TRIE.get(key)
+            if child is None:
+                child = TRIE[key] = len(CODE)
+                CODE.append(-1)
+                LENGTH.append(LENGTH[node]+1)
+            node = child
+            if CODE[node] < 0 and len(NODE) < self.limit:
+                CODE[node] = len(NODE)
+                NODE.append(node)
+                if STRINGS is not None:
+                    STRINGS.append(STRINGS[previous] + match[:k])
+
+class LZMWCompressor(LZWCompressor):
+    MIN_BITS = VariableWidthLZWCompressor.MIN_BITS
+    MAX_BITS = VariableWidthLZWCompressor.MAX_BITS
+    TABLE = LZMWTable
+
+    def __init__(self, writer:BaseLZWWriter=None, stats:LZWStats=None, max_bits:int=None, preset=None):
+        if preset is not None:
+            raise ValueError('Error: preset dictionaries cannot be used with LZMW or LZAP')
+        super(LZMWCompressor, self).__init__(writer, stats, max_bits)
+        self.table = self.TABLE(self.MAX_BITS)
+        self.pending = b'' # bytes whose longest match may go on in the next chunk
+        self.update_code_size(self.MIN_BITS)
+
+    def update_code_size(self, code_size:int):
+        self.N_BITS = code_size
+        self.EOF = dict_limit(code_size)
+        self.writer.set_code_size(self.N_BITS)
+
+    def feed(self, chunk)->bytes:
+        self.encode(self.pending + chunk, final=False)
+        return self.drain()
+
+    '''
+        *Emit the longest match at every position; without final, the last match is kept pending
+        while it reaches the end of data, since it may go on
+    '''
+    def encode(self, data:bytes, final:bool):
+        table, codes = self.table, self.codes
+        TRIE, CODE = table.TRIE, table.CODE
+        i, n = 0, len(data)
+        while i < n:
+            node = data[i]
+            code, end = node, i+1
+            j = end
+            while j < n:
+                node = TRIE.get((node << 8) | data[j])
+                if node is None:
+                    break
+                j += 1
+                if CODE[node] >= 0:
+                    code, end = CODE[node], j
+            else:
+                if not final:
+                    break
+            codes.append(code)
+            if table.update(code, data[i:end]):
+                self.resets += 1
+            i = end
+
+            code_size = max(self.MIN_BITS, len(table).bit_length())
+            if code_size != self.N_BITS or len(codes) >= CHUNK_SIZE:
+                self.write_codes()
+            if code_size != self.N_BITS:
+                self.width_changes += 1
+                self.update_code_size(code_size)
+        self.pending = data[i:]
+
+    def end_member(self):
+        self.encode(self.pending, final=True)
+        self.codes.append(self.EOF)
+        self.table.previous = None
+
+    def finish(self)->bytes:
+        if self.pending or self.table.previous is not None:
+            self.end_member()
+        return super(LZMWCompressor, self).finish()
+
+class LZMWDecompressor(LZWDecompressor):
+    MIN_BITS = LZMWCompressor.MIN_BITS
+    MAX_BITS = LZMWCompressor.MAX_BITS
+    TABLE = LZMWTable
+
+    def __init__(self, reader:BaseLZWWriter=None, writer:FilesWriter=None, members:int=1, lzw_dict:LZWDict=None, max_bits:int=None, preset=None):
+        if preset is not None:
+            raise ValueError('Error: preset dictionaries cannot be used with LZMW or LZAP')
+        # the strings are kept in the table, not in the dictionary of LZWDecompressor
+        super(LZMWDecompressor, self).__init__(reader, writer, members, LZWDict(), max_bits)
+        self.table = self.TABLE(self.MAX_BITS, keep_strings=True)
+        self.update_code_size(self.MIN_BITS)
+
+    def update_code_size(self, code_size:int):
+        self.N_BITS = code_size
+        self.EOF = dict_limit(code_size)
+        self.reader.set_code_size(self.N_BITS)
+
+    def decode(self):
+        table, out, writer, reader = self.table, self.out, self.writer, self.reader
+        STRINGS = table.STRINGS
+        i, pos = self.i, 0
+        if i >= self.members:
+            return
+
+        for CODE in iter(reader.read_code, None):
+            if CODE == self.EOF:
+                writer.write(i, memoryview(out)[:pos])
+                pos = 0
+                table.previous = None
+                i += 1
+                if i >= self.members: break
+                continue
+            string = STRINGS[CODE]
+            out[pos:pos+len(string)] = string
+            pos += len(string)
+            if pos >= CHUNK_SIZE:
+                writer.write(i, memoryview(out)[:pos])
+                pos = 0
+            table.update(CODE, string)
+            code_size = max(self.MIN_BITS, len(table).bit_length())
+            if code_size != self.N_BITS:
+                self.update_code_size(code_size)
+
+        if pos > 0:
+            writer.write(i, memoryview(out)[:pos])
+        self.i = i
+
+class LZMWProcessor(LZWProcessor):
+    COMPRESSOR = LZMWCompressor
+    DECOMPRESSOR = LZMWDecompressor
+    VARIANT = 'lzmw'
+
+class LZAPCompressor(LZMWCompressor):
+    TABLE = LZAPTable
+
+class LZAPDecompressor(LZMWDecompressor):
+    TABLE = LZAPTable
+
+class LZAPProcessor(LZWProcessor):
+    COMPRESSOR = LZAPCompressor
+    DECOMPRESSOR = LZAPDecompressor
+    VARIANT = 'lzap'
+
+'''
+    *Header options, stored as an extra first line of the file header.
+    File names cannot contain NUL, so old archives never start with HEADER_MARK.
+    Every option changes how the archive is decoded, so archives of a later version or with an unknown option are refused.
+'''
+HEADER_MARK = '\0'
+HEADER_VERSION = 2
+HEADER_OPTIONS = {'version', 'members', 'sizes', 'block_size', 'variant', 'clear', 'bits', 'preset', 'dups', 'crc'}
+
+def write_header_options(options:dict)->str:
+    return HEADER_MARK + ';'.join(f'{key}={value}' for key, value in options.items())
+
+def read_header_options(file_names:list)->tuple[dict, list]:
+    if len(file_names) == 0 or not file_names[0].startswith(HEADER_MARK):
+        return dict(), file_names
+    options = dict(option.split('=', 1) for option in file_names[0][len(HEADER_MARK):].split(';') if option)
+    version = options.get('version', '1')
+    if not version.isdigit() or int(version) > HEADER_VERSION:
+        raise ValueError(f'Error: unsupported archive version {version}; archives up to version {HEADER_VERSION} can be read')
+    unknown = sorted(options.keys() - HEADER_OPTIONS)
+    if unknown:
+        raise ValueError(f"Error: unsupported archive option {', '.join(unknown)}")
+    return options, file_names[1:]
+
+'''
+    *Archives record the LZW variant, CLEAR-code mode and the code size they were compressed with, if not the defaults,
+    so that they are decompressed with the right processor.
+'''
+CODE_SIZES = range(9, 25) # valid values of max_bits
+
+def processor_options(lzw_processor, max_bits:int=None, preset=None)->dict:
+    options = dict()
+    if lzw_processor.VARIANT is not None:
+        options['variant'] = lzw_processor.VARIANT
+    if lzw_processor.CLEAR:
+        options['clear'] = 1
+    if max_bits is not None:
+        options['bits'] = max_bits
+    if preset is not None:
+        options['preset'] = preset.digest
+    return options
+
+def options_processor(options:dict, lzw_processor, max_bits:int=None)->tuple:
+    if 'variant' in options:
+        if options['variant'] not in VARIANT_PROCESSORS:
+            raise ValueError(f"Error: unknown LZW variant {options['variant']}")
+        lzw_processor = VARIANT_PROCESSORS[options['variant']]
+    elif options.get('clear') == '1' and not lzw_processor.CLEAR:
+        lzw_processor = CLEAR_CODE_PROCESSORS[lzw_processor is LZW_PROCESSORS[True]]
+    if 'bits' in options:
+        max_bits = int(options['bits'])
+    if max_bits is not None and max_bits not in CODE_SIZES:
+        raise ValueError(f'Error: code size {max_bits} is not between {CODE_SIZES[0]} and {CODE_SIZES[-1]}')
+    return lzw_processor, max_bits
+
+'''
+    *Preset dictionaries
+    Small files end before LZW has learnt much, so a dictionary trained on similar files can be given to start from:
+    its entries follow the 256 single bytes in every fresh dictionary, of the compressor and the decompressor alike.
+    Archives only record the BLAKE2 digest of the preset, and the same preset has to be given to decompress them.
+    A preset file is MAGIC followed by the entries as 4-byte big-endian keys of PrefixLZWDict, prefix_code << 8 | char.
+'''
+class PresetDictionary:
+    MAGIC = b'LZWPRESET\n'
+    MAX_ENTRIES = 2**11 # so that variable-width code starts at 12 bits at most
+    TRAINING_ENTRIES = 2**20 # largest dictionary built while training
+
+    def __init__(self, keys):
+        self.keys = array('I', keys)
+        if len(self.keys) > self.MAX_ENTRIES:
+            raise ValueError(f'Error: a preset dictionary has at most {self.MAX_ENTRIES} entries')
+        for code, key in enumerate(self.keys, 256):
+            if key >> 8 >= code:
+                raise ValueError('Error: every entry of a preset dictionary has to extend an earlier one')
+        self.digest = hashlib.blake2b(self.to_bytes(), digest_size=16).hexdigest()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def to_bytes(self)->bytes:
+        return self.MAGIC + b''.join(key.to_bytes(4, 'big') for key in self.keys)
+
     @classmethod
-    def decompress(cls, reader:BaseLZWWriter, output_file_names):
-        print(f"\nDeompressing {reader.name} into {', '.join(output_file_names)}")
+    def from_bytes(cls, data:bytes):
+        if not data.startswith(cls.MAGIC) or (len(data)-len(cls.MAGIC)) % 4 != 0:
+            raise ValueError('Error: not a preset dictionary')
+        data = data[len(cls.MAGIC):]
+        return cls(int.from_bytes(data[i:i+4], 'big') for i in range(0, len(data), 4))
 
-        lzw_dict = LZWDict()
-        DICT = lzw_dict.init_dict_decomp(dict())
-        reader.initialize()
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name, 'rb') as preset_file:
+            return cls.from_bytes(preset_file.read())
 
-        cls.update_code_size(reader, cls.MIN_BITS)
+    def save(self, file_name):
+        with open(file_name, 'wb') as preset_file:
+            preset_file.write(self.to_bytes())
 
-        STRING, CHAR = None, None
+    '''
+        Compress the samples, each from its first byte, with one dictionary of up to TRAINING_ENTRIES entries,
+        counting how often every entry is emitted. The entries saving the most codes are kept, along with the
+        prefixes they extend, and renumbered from 256 in the order they were learnt.
+    '''
+    @classmethod
+    def train(cls, samples, size:int=1024):
+        if not 0 < size <= cls.MAX_ENTRIES:
+            raise ValueError(f'Error: the size of a preset dictionary is between 1 and {cls.MAX_ENTRIES}')
+        DICT, KEYS = dict(), []
+        uses = [0]*256
+        for sample in samples:
+            chars = iter(sample)
+            STRING = next(chars, None)
+            for CHAR in chars:
+                KEY = (STRING << 8) | CHAR
+                code = DICT.get(KEY)
+                if code is not None:
+                    STRING = code
+                    continue
+                uses[STRING] += 1
+                if len(KEYS) < cls.TRAINING_ENTRIES:
+                    DICT[KEY] = 256 + len(KEYS)
+                    KEYS.append(KEY)
+                    uses.append(0)
+                STRING = CHAR
+            if STRING is not None:
+                uses[STRING] += 1
+
+        length = [1]*256
+        for KEY in KEYS:
+            length.append(length[KEY >> 8] + 1)
+
+        selected = set()
+        for code in sorted(range(256, 256 + len(KEYS)), key=lambda code: (-uses[code]*(length[code]-1), code)):
+            if uses[code] == 0 or len(selected) >= size:
+                break
+            chain = []
+            while code >= 256 and code not in selected:
+                chain.append(code)
+                code = KEYS[code-256] >> 8
+            if len(selected) + len(chain) <= size:
+                selected.update(chain)
+
+        codes = {v: v for v in range(256)}
+        keys = []
+        for code in sorted(selected):
+            KEY = KEYS[code-256]
+            codes[code] = 256 + len(keys)
+            keys.append((codes[KEY >> 8] << 8) | (KEY & 0xFF))
+        return cls(keys)
 
-        CURRENT = reader.read_code()
-        writer = FilesWriter(output_file_names)
-        i = 0
-        while True:
-            NEXT = reader.read_code()
-            if NEXT == cls.EOF: 
-                writer.write(i, DICT[CURRENT])
-                i += 1
-                if i >= len(writer.file_names):
-                    break
+'''
+    *Return the preset to decompress an archive with, checking it against the digest in its header
+'''
+def options_preset(options:dict, preset:PresetDictionary=None)->PresetDictionary|None:
+    if 'preset' not in options:
+        return None
+    if preset is None:
+        raise ValueError(f"Error: the archive was compressed with the preset dictionary {options['preset']}, which has to be given with --preset")
+    if preset.digest != options['preset']:
+        raise ValueError(f"Error: the archive was compressed with the preset dictionary {options['preset']}, not {preset.digest}")
+    return preset
 
-                CURRENT = reader.read_code()
-                STRING, CHAR = None, None
-                if CURRENT is None: break
-                continue
-            
-            STRING = DICT[CURRENT] 
-            writer.write(i, STRING)
-            if NEXT is None: break
-            if NEXT in DICT:
-                CHAR = bytes([DICT[NEXT][0]])
+'''
+    *Deduplication
+    Input files with the same content are compressed once. The header option dups lists every later copy
+    as index:original_index, the copies have no member of their own in the archive, and the decompressor copies
+    the output of the original for them. Only files whose size is shared by another one are hashed.
+'''
+def file_digest(input_file_name)->bytes:
+    digest = hashlib.blake2b()
+    with open_input_file(input_file_name) as input_file:
+        for chunk in iter_input_chunks(input_file):
+            digest.update(chunk)
+    return digest.digest()
+
+def find_duplicates(input_file_names)->dict[int, int]:
+    by_size = dict()
+    for i, input_file_name in enumerate(input_file_names):
+        if input_file_name != STDIO_NAME: # stdin can only be read once
+            by_size.setdefault(os.path.getsize(input_file_name), []).append(i)
+    duplicates, originals = dict(), dict()
+    for indices in by_size.values():
+        for i in (indices if len(indices) > 1 else []):
+            digest = file_digest(input_file_names[i])
+            if digest in originals:
+                duplicates[i] = originals[digest]
             else:
-                CHAR = bytes([STRING[0]])
-            if len(DICT) >= cls.CUR_DICT_LIMIT-1: # To cater for variable-width code
-                if cls.N_BITS < cls.MAX_BITS:
-                    cls.update_code_size(reader, cls.N_BITS+1)
-                    lzw_dict.update_dict_decomp(DICT, len(DICT), STRING+CHAR)
-                else:
-                    # Write the string first
-                    STRING = DICT[NEXT]
-                    writer.write(i, STRING)
-                    # Reset the dictionary
-                    lzw_dict.init_dict_decomp(DICT)
-                    cls.update_code_size(reader, cls.MIN_BITS)
-                    # Read next character
-                    CURRENT = NEXT = reader.read_code()
-                    STRING, CHAR = None, None
-                    if CURRENT is None: break
+                originals[digest] = i
+    return duplicates
+
+def find_duplicate_members(members:list[bytes])->dict[int, int]:
+    duplicates, originals = dict(), dict()
+    for i, data in enumerate(members):
+        digest = hashlib.blake2b(data).digest()
+        if digest in originals:
+            duplicates[i] = originals[digest]
+        else:
+            originals[digest] = i
+    return duplicates
+
+def duplicate_options(duplicates:dict[int, int])->dict:
+    return {'dups': ','.join(f'{i}:{j}' for i, j in duplicates.items())} if duplicates else dict()
+
+def options_duplicates(options:dict)->dict[int, int]:
+    if 'dups' not in options:
+        return dict()
+    return {int(i): int(j) for i, j in (dup.split(':') for dup in options['dups'].split(','))}
+
+def unique_members(names:list, duplicates:dict[int, int])->list:
+    return [name for i, name in enumerate(names) if i not in duplicates]
+
+'''
+    *Decompress only the originals: every original is written to its own output file if it is selected,
+    or else to that of its first selected copy. Return the output files and selection of the originals,
+    and the (source, destination) pairs to copy once they are written.
+'''
+def plan_duplicates(output_file_names:list, selected:list, duplicates:dict[int, int])->tuple[list, list, list]:
+    copies_of = dict()
+    for i, j in duplicates.items():
+        copies_of.setdefault(j, []).append(i)
+
+    names, unique_selected, copies = [], [], []
+    for j, output_file_name in enumerate(output_file_names):
+        if j in duplicates:
+            continue
+        group = [j] + copies_of.get(j, [])
+        wanted = [output_file_names[i] for i in group if selected is None or selected[i]]
+        names.append(wanted[0] if wanted else output_file_name)
+        unique_selected.append(len(wanted) > 0)
+        copies += [(wanted[0], name) for name in wanted[1:] if name != wanted[0]]
+    return names, (None if selected is None else unique_selected), copies
+
+def copy_duplicates(copies:list):
+    for source, destination in copies:
+        print(f"\tCopying {source} to {destination} ...")
+        shutil.copyfile(source, destination)
+
+'''
+    *Integrity checks
+    With --crc, the CRC32 of every member, or of every block with -b, is computed while it is compressed and stored
+    in CRC_SIZE hex digits: in front of every member of -j archives and every block of -b archives, and after the
+    stream of single-stream archives, where they end the archive (or segment). Decompression checks every file
+    against its CRC32, and --test does so without writing any file.
+'''
+CRC_SIZE = 8
+
+class ChecksumError(ValueError):
+    pass
+
+def crc_options(crc:bool, block_size=None)->dict:
+    if not crc:
+        return dict()
+    return {'crc': 'member' if block_size is None else 'block'}
+
+def write_crcs(crcs:list[int])->bytes:
+    return ''.join(f'{crc:0{CRC_SIZE}x}' for crc in crcs).encode('ascii')
+
+def read_crcs(data)->list[int]:
+    return [int(data[i:i+CRC_SIZE], 16) for i in range(0, len(data), CRC_SIZE)]
+
+def check_crc(name, data_crc:int, crc:int):
+    if data_crc != crc:
+        raise ChecksumError(f'Error: {name} is corrupted, its CRC32 is {data_crc:0{CRC_SIZE}x} instead of {crc:0{CRC_SIZE}x}')
+
+'''
+    *The trailer of a single stream: the stream is padded to a whole output unit, so that the CRC32s end the archive
+'''
+def write_crc_trailer(writer:BaseLZWWriter, crcs:list[int]):
+    writer.align_output()
+    writer.write_bytes(write_crcs(crcs))
+    writer.flush()
+
+'''
+    *Writable file object over an output file, or a file object that is left open,
+    computing the CRC32 of what is written to it
+'''
+class CRCFile:
+    def __init__(self, file, size=None):
+        self.file, self.name = file, file_name(file)
+        self.size = size
+        self.output = None if isinstance(file, str) else file
+        self.crc = 0
+
+    def write(self, data):
+        if self.output is None:
+            self.output = MmapFile(self.file, self.size) if self.size else open(self.file, 'wb')
+        self.crc = zlib.crc32(data, self.crc)
+        return self.output.write(data)
+
+    def close(self):
+        if isinstance(self.file, str) and self.output is not None and not self.output.closed:
+            self.output.close()
+
+    def check(self, crc:int):
+        self.close()
+        check_crc(self.name, self.crc, crc)
+
+'''
+    *Check the files written to crc_files against the trailer of a single stream read from input_file.
+    Return whether they could be checked.
+'''
+def check_crc_trailer(input_file, crc_files:list[CRCFile])->bool:
+    trailer = input_file.read_tail(CRC_SIZE*len(crc_files))
+    if trailer is None:
+        for crc_file in crc_files:
+            crc_file.close()
+        print('Warning: the checksums of an archive with appended segments are only checked when it is decompressed from a file.')
+        return False
+    for crc_file, crc in zip(crc_files, read_crcs(trailer)):
+        crc_file.check(crc)
+    return True
+
+'''
+    *Parallel Compression
+    Each input file is compressed independently as a member, with a fresh dictionary.
+    Since version 2, the header options index every member by its compressed size and original size;
+    members are byte-aligned, so the offset of a member is the sum of the compressed sizes before it.
+    With crc, every member starts with the CRC32 of its file.
+'''
+def compress_member(lzw_processor, base_writer, encryptor, encrypt_key, input_file_name, use_mmap=False, max_bits=None, preset=None, crc=False)->bytes:
+    output_file = io.BytesIO()
+    output_file.name = file_name(input_file_name)
+    writer = encryptor(base_writer(output_file, code_size=CODE_SIZE), encrypt_key=encrypt_key)
+    crcs = lzw_processor.compress(writer, [input_file_name], use_mmap, None, max_bits, preset)
+    return (write_crcs(crcs) if crc else b'') + output_file.getvalue()
+
+def decompress_member(lzw_processor, base_writer, encryptor, encrypt_key, data, output_file_name, lzw_dict=None, size=None, max_bits=None, preset=None, crc=False):
+    if crc:
+        expected_crc, data = read_crcs(data[:CRC_SIZE])[0], data[CRC_SIZE:]
+        crc_file = CRCFile(output_file_name, size)
+        output_file_name, size = crc_file, None
+    input_file = io.BytesIO(data)
+    input_file.name = file_name(output_file_name)
+    reader = encryptor(base_writer(input_file, code_size=CODE_SIZE), encrypt_key=encrypt_key)
+    lzw_processor.decompress(reader, [output_file_name], lzw_dict, None if size is None else [size], max_bits, preset)
+    if crc:
+        crc_file.check(expected_crc)
+
+'''
+    *The header indexing the members comes first, so the members are spooled to a temporary file in order
+    as they complete, with at most window of them pending at a time, and copied after it.
+'''
+def compress_parallel(lzw_processor, writer:BaseLZWWriter, base_writer, encryptor, encrypt_key, input_file_names, jobs, use_mmap=False, max_bits=None, preset=None, duplicates=None, crc=False):
+    unique_file_names = unique_members(input_file_names, duplicates or dict())
+    window = 2*(jobs or os.cpu_count())
+    member_sizes = []
+    with tempfile.TemporaryFile() as spool:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for member in map_bounded(executor, compress_member, repeat(lzw_processor), repeat(base_writer), repeat(encryptor), repeat(encrypt_key), unique_file_names, repeat(use_mmap), repeat(max_bits), repeat(preset), repeat(crc), window=window):
+                spool.write(member)
+                member_sizes.append(len(member))
+
+        options = {
+            'version': HEADER_VERSION,
+            'members': ','.join(map(str, member_sizes)),
+            'sizes': ','.join(str(os.path.getsize(input_file_name)) for input_file_name in unique_file_names),
+            **processor_options(lzw_processor, max_bits, preset),
+            **duplicate_options(duplicates or dict()),
+            **crc_options(crc),
+        }
+        writer.write_file_header([write_header_options(options)] + input_file_names)
+        writer.align_output()
+        spool.seek(0)
+        for chunk in iter(lambda: spool.read(CHUNK_SIZE), b''):
+            writer.write_bytes(chunk)
+    writer.flush()
+
+'''
+    *Only the members flagged in selected are read and decompressed; the others are skipped over.
+    Members are read as they are submitted, with at most window of them pending at a time.
+    With use_mmap, the output files are preallocated to their original sizes and written through mmap.
+'''
+def decompress_parallel(lzw_processor, reader:BaseLZWWriter, base_writer, encryptor, encrypt_key, options, output_file_names, jobs, lzw_dict=None, selected=None, use_mmap=False, max_bits=None, preset=None):
+    reader.align_input()
+    member_sizes = [int(size) for size in options['members'].split(',')]
+    original_sizes = [int(size) for size in options['sizes'].split(',')] if use_mmap and 'sizes' in options else repeat(None)
+    names, sizes = [], []
+    for i, original_size in zip(range(len(member_sizes)), original_sizes):
+        if selected is None or selected[i]:
+            names.append(output_file_names[i])
+            sizes.append(original_size)
+
+    def read_members():
+        for i, size in enumerate(member_sizes):
+            if selected is None or selected[i]:
+                yield reader.read_bytes(size)
             else:
-                lzw_dict.update_dict_decomp(DICT, len(DICT), STRING+CHAR)
-            CURRENT = NEXT
-        writer.close()
-                
-        print("\tDone.")
+                reader.skip_bytes(size)
+
+    window = 2*(jobs or os.cpu_count())
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for _ in map_bounded(executor, decompress_member, repeat(lzw_processor), repeat(base_writer), repeat(encryptor), repeat(encrypt_key), read_members(), names, repeat(lzw_dict), sizes, repeat(max_bits), repeat(preset), repeat('crc' in options), window=window):
+            pass
+
+'''
+    *Run fn over the arguments in the executor, yielding the results in order,
+    with at most window tasks pending at a time
+'''
+def map_bounded(executor, fn, *iterables, window):
+    pending = deque()
+    for args in zip(*iterables):
+        pending.append(executor.submit(fn, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+'''
+    *Block Compression
+    Every input file is split into blocks of block_size bytes, each compressed independently with a fresh dictionary.
+    A compressed block is preceded by its size in BLOCK_PREFIX_SIZE hex digits, which are valid characters
+    in every binary-to-text encoding, and a size of zero ends the file. With crc, every block starts with its CRC32.
+'''
+BLOCK_PREFIX_SIZE = 8
+
+def compress_block(lzw_processor, base_writer, encryptor, encrypt_key, input_file_name, offset, block_size, max_bits=None, preset=None, crc=False)->bytes:
+    with open(input_file_name, 'rb') as input_file:
+        input_file.seek(offset)
+        block = io.BytesIO(input_file.read(block_size))
+    block.name = f'{input_file_name}@{offset}'
+    return compress_member(lzw_processor, base_writer, encryptor, encrypt_key, block, max_bits=max_bits, preset=preset, crc=crc)
+
+def decompress_block(lzw_processor, base_writer, encryptor, encrypt_key, data, lzw_dict=None, max_bits=None, preset=None, crc=False, name='block')->bytes:
+    output_file = io.BytesIO()
+    output_file.name = name # named in the errors of a corrupted block
+    decompress_member(lzw_processor, base_writer, encryptor, encrypt_key, data, output_file, lzw_dict, max_bits=max_bits, preset=preset, crc=crc)
+    return output_file.getvalue()
+
+def read_blocks(reader:BaseLZWWriter):
+    while True:
+        block_size = int(reader.read_bytes(BLOCK_PREFIX_SIZE), 16)
+        if block_size == 0:
+            return
+        yield reader.read_bytes(block_size)
+
+def compress_blocks(lzw_processor, writer:BaseLZWWriter, base_writer, encryptor, encrypt_key, input_file_names, block_size, jobs, max_bits=None, preset=None, duplicates=None, crc=False):
+    options = {'block_size': block_size, **processor_options(lzw_processor, max_bits, preset), **duplicate_options(duplicates or dict()), **crc_options(crc, block_size)}
+    writer.write_file_header([write_header_options(options)] + input_file_names)
+    writer.align_output()
+
+    window = 2*(jobs or os.cpu_count())
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for input_file_name in unique_members(input_file_names, duplicates or dict()):
+            offsets = range(0, os.path.getsize(input_file_name), block_size)
+            for block in map_bounded(executor, compress_block, repeat(lzw_processor), repeat(base_writer), repeat(encryptor), repeat(encrypt_key), repeat(input_file_name), offsets, repeat(block_size), repeat(max_bits), repeat(preset), repeat(crc), window=window):
+                writer.write_bytes(f'{len(block):0{BLOCK_PREFIX_SIZE}x}'.encode('ascii') + block)
+            writer.write_bytes(b'0'*BLOCK_PREFIX_SIZE)
+    writer.flush()
+
+def skip_blocks(reader:BaseLZWWriter):
+    while True:
+        block_size = int(reader.read_bytes(BLOCK_PREFIX_SIZE), 16)
+        if block_size == 0:
+            return
+        reader.skip_bytes(block_size)
+
+def decompress_blocks(lzw_processor, reader:BaseLZWWriter, base_writer, encryptor, encrypt_key, output_file_names, jobs, lzw_dict=None, selected=None, max_bits=None, preset=None, crc=False):
+    reader.align_input()
+
+    window = 2*(jobs or os.cpu_count())
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for i, output_file_name in enumerate(output_file_names):
+            if selected is not None and not selected[i]:
+                skip_blocks(reader)
+                continue
+            block_names = (f'block {j} of {file_name(output_file_name)}' for j in count())
+            with open_output_file(output_file_name) as output_file:
+                for block in map_bounded(executor, decompress_block, repeat(lzw_processor), repeat(base_writer), repeat(encryptor), repeat(encrypt_key), read_blocks(reader), repeat(lzw_dict), repeat(max_bits), repeat(preset), repeat(crc), block_names, window=window):
+                    output_file.write(block)
+
+'''
+    *Append mode
+    New files are added to an archive without recompressing it: they are compressed into a segment, a complete
+    archive of its own written after the existing ones, and a trailer at the end of the file indexes the segments
+    as offset:size, followed by the size of the index in SEGMENT_INDEX_SIZE hex digits and SEGMENT_MARK.
+    An archive without a trailer is a single segment. The segments are decompressed in turn, so a file appended
+    again replaces the earlier copy, and they all have to be read with the same -e, -t, -v and --cipher.
+'''
+SEGMENT_MARK = b'#LZW-SEGMENTS\n' # '#' and '-' are never output by the hex and base64 writers
+SEGMENT_INDEX_SIZE = 16
+
+def read_segments(input_file)->list[tuple[int, int]]:
+    end = input_file.seek(0, os.SEEK_END)
+    tail_size = SEGMENT_INDEX_SIZE + len(SEGMENT_MARK)
+    if end >= tail_size:
+        input_file.seek(end - tail_size)
+        tail = input_file.read(tail_size)
+        if tail.endswith(SEGMENT_MARK):
+            index_size = int(tail[:SEGMENT_INDEX_SIZE], 16)
+            input_file.seek(end - tail_size - index_size)
+            index = input_file.read(index_size).decode('ascii')
+            return [tuple(int(value) for value in segment.split(':')) for segment in index.split(',')]
+    return [(0, end)]
+
+'''
+    *Read-only file object over size bytes of a file from offset, so that readers reading ahead stop at the end of a segment
+'''
+class SegmentFile:
+    def __init__(self, file, offset, size):
+        self.file, self.name = file, file_name(file)
+        self.offset, self.end = offset, offset + size
+        file.seek(offset)
+
+    def read(self, n=-1):
+        remaining = max(self.end - self.file.tell(), 0)
+        return self.file.read(remaining if n is None or n < 0 else min(n, remaining))
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def keep_tail(self, n):
+        pass
+
+    def read_tail(self, n)->bytes:
+        self.file.seek(max(self.end - n, self.offset))
+        return self.read(n)
+
+def write_segments(output_file, segments:list[tuple[int, int]]):
+    index = ','.join(f'{offset}:{size}' for offset, size in segments).encode('ascii')
+    output_file.write(index + f'{len(index):0{SEGMENT_INDEX_SIZE}x}'.encode('ascii') + SEGMENT_MARK)
+
+'''
+    *Open an archive to append a segment to, positioned right after its segments, and return it with its segments
+    and the bytes of its trailer, which the new segment is written over; a missing archive is created,
+    with no segments and a trailer of None
+'''
+def open_append(archive_name)->tuple:
+    if not exists(archive_name):
+        os.makedirs(dirname(archive_name) or '.', exist_ok=True)
+        return open(archive_name, 'wb'), [], None
+    output_file = open(archive_name, 'r+b')
+    segments = read_segments(output_file)
+    offset, size = segments[-1]
+    output_file.seek(offset + size)
+    trailer = output_file.read()
+    output_file.seek(offset + size)
+    # *an empty archive has no segments yet
+    return output_file, segments if size > 0 else [], trailer
+
+'''
+    *Undo an append that failed before the index was rewritten: put the trailer back after the segments,
+    or remove the archive if it was created
+'''
+def restore_append(output_file, archive_name, offset, trailer):
+    if trailer is None:
+        output_file.close()
+        os.remove(archive_name)
+        return
+    output_file.seek(offset)
+    output_file.write(trailer)
+    output_file.truncate()
+    output_file.close()
+
+'''
+    *An archive read from stdin cannot seek to its trailer: this file object remembers the last bytes read,
+    and has_segments() reads the rest of the archive to tell whether it ends with one.
+    Everything is remembered until keep_tail() is told, once the header is read, how long a tail read_tail() needs.
+    The last HOLD_SIZE bytes are held back until the end is reached, so that the segment trailer, which is not
+    in the alphabet of the hex and base64 writers, is dropped before a reader reading ahead gets to it.
+'''
+class TailFile:
+    HOLD_SIZE = CHUNK_SIZE # enough for the trailer of thousands of segments
+
+    def __init__(self, file):
+        self.file, self.name = file, file_name(file)
+        self.tail = b''
+        self.tail_size = None
+        self.ahead = b''
+        self.segments = None # whether the archive ends with segments, known once it is read to the end
+
+    def read(self, n=-1):
+        whole = n is None or n < 0
+        while self.segments is None and (whole or len(self.ahead) < n + self.HOLD_SIZE):
+            data = self.file.read(CHUNK_SIZE)
+            self.ahead += data
+            if not data:
+                self.drop_trailer()
+        data = self.ahead if whole else self.ahead[:n]
+        self.ahead = self.ahead[len(data):]
+        if self.tail_size is None:
+            self.tail += data
+        elif self.tail_size > 0:
+            self.tail = (self.tail + data[-self.tail_size:])[-self.tail_size:]
+        return data
+
+    def drop_trailer(self):
+        self.segments = self.ahead.endswith(SEGMENT_MARK)
+        if self.segments:
+            end = len(self.ahead) - SEGMENT_INDEX_SIZE - len(SEGMENT_MARK)
+            index_size = int(self.ahead[end:end + SEGMENT_INDEX_SIZE], 16)
+            self.ahead = self.ahead[:max(end - index_size, 0)]
+
+    def seekable(self):
+        return False
+
+    def keep_tail(self, n):
+        self.tail_size = n
+        self.tail = self.tail[-n:] if n > 0 else b''
+
+    def read_tail(self, n)->bytes|None:
+        # *None if the archive ends with segments, whose trailer is not that of the first one
+        return None if self.has_segments() else self.tail[-n:]
+
+    def has_segments(self)->bool:
+        while self.read(CHUNK_SIZE):
+            pass
+        return self.segments
 
 LZW_PROCESSORS = {False:LZWProcessor, True:VariableWidthLZWProcessor}
+CLEAR_CODE_PROCESSORS = {False:ClearCodeLZWProcessor, True:VariableWidthClearCodeLZWProcessor}
+VARIANT_PROCESSORS = {'lzmw':LZMWProcessor, 'lzap':LZAPProcessor}
 BASE_WRITERS = {'none':LZWWriter, 'hex':HexLZWWriter, 'base64':Base64LZWWriter}
 
+'''
+    *In-memory API
+    Compress and decompress bytes without files or terminal output.
+    compress_bytes() produces a bare stream with no file header; compress_files() produces a whole archive,
+    as written by the command line without -j or -b. decompress_files() also reads -j, -b and appended archives,
+    and append_files() adds the files to an archive as a new segment. Archives made with crc are checked
+    while they are decompressed, raising ChecksumError on a mismatch.
+'''
+def make_writer(file, key=None, text='none', cipher='random')->BaseLZWWriter:
+    return ENCRYPTORS[cipher](BASE_WRITERS[text](file, code_size=CODE_SIZE), encrypt_key=key)
+
+def compress_bytes(data, variable=False, key=None, text='none', logger:logging.Logger=None, stats:LZWStats=None, cipher='random', max_bits:int=None, preset:PresetDictionary=None)->bytes:
+    output_file = io.BytesIO()
+    if stats is None:
+        compressor = LZW_PROCESSORS[variable].COMPRESSOR(make_writer(output_file, key, text, cipher), max_bits=max_bits, preset=preset)
+        compressor.feed(data)
+        compressor.finish()
+    else:
+        compressor = LZW_PROCESSORS[variable].COMPRESSOR(make_writer(stats.wrap_output(output_file), key, text, cipher), stats, max_bits, preset)
+        stats.begin_member('<bytes>', compressor)
+        for chunk in stats.timed_chunks([data]):
+            stats.timed(compressor.feed)(chunk)
+        if len(data) > 0: # as finish() would, so that the last codes count towards the member
+            stats.timed(compressor.end_member)()
+        stats.end_member(compressor)
+        stats.timed(compressor.finish)()
+    if logger is not None:
+        logger.debug('Compressed %d bytes into %d bytes', len(data), output_file.tell())
+    return output_file.getvalue()
+
+def decompress_bytes(blob, variable=False, key=None, text='none', logger:logging.Logger=None, cipher='random', lzw_processor=None, max_bits:int=None, preset:PresetDictionary=None)->bytes:
+    return decompress_stream(make_writer(io.BytesIO(blob), key, text, cipher), variable, 1, logger, lzw_processor, max_bits, preset)[0]
+
+def decompress_stream(reader:BaseLZWWriter, variable, members, logger:logging.Logger=None, lzw_processor=None, max_bits:int=None, preset:PresetDictionary=None)->list[bytes]:
+    output_files = [io.BytesIO() for _ in range(members)]
+    lzw_processor = lzw_processor or LZW_PROCESSORS[variable]
+    lzw_processor.DECOMPRESSOR(reader, FilesWriter(output_files, log=None), members, max_bits=max_bits, preset=preset).finish()
+    if logger is not None:
+        logger.debug('Decompressed %d members from %s', members, reader.name)
+    return [output_file.getvalue() for output_file in output_files]
+
+def compress_files(files:dict[str, bytes], variable=False, key=None, text='none', logger:logging.Logger=None, cipher='random', max_bits:int=None, preset:PresetDictionary=None, dedup=True, crc=False)->bytes:
+    output_file = io.BytesIO()
+    writer = make_writer(output_file, key, text, cipher)
+    duplicates = find_duplicate_members(list(files.values())) if dedup else dict()
+    options = {**processor_options(LZW_PROCESSORS[variable], max_bits, preset), **duplicate_options(duplicates), **crc_options(crc)}
+    writer.write_file_header(([write_header_options(options)] if options else []) + list(files))
+    compressor = LZW_PROCESSORS[variable].COMPRESSOR(writer, max_bits=max_bits, preset=preset)
+    crcs = []
+    for name, data in unique_members(list(files.items()), duplicates):
+        compressor.feed(data)
+        compressor.end_member()
+        crcs.append(zlib.crc32(data))
+        if logger is not None:
+            logger.debug('Compressed %s (%d bytes)', name, len(data))
+    compressor.finish()
+    if crc:
+        write_crc_trailer(writer, crcs)
+    return output_file.getvalue()
+
+def append_files(blob, files:dict[str, bytes], variable=False, key=None, text='none', logger:logging.Logger=None, cipher='random', max_bits:int=None, preset:PresetDictionary=None, dedup=True, crc=False)->bytes:
+    segment = compress_files(files, variable, key, text, logger, cipher, max_bits, preset, dedup, crc)
+    if len(blob) == 0:
+        return segment
+    segments = read_segments(io.BytesIO(blob))
+    offset, size = segments[-1]
+    output_file = io.BytesIO()
+    output_file.write(blob[:offset+size] + segment)
+    write_segments(output_file, segments + [(offset+size, len(segment))])
+    return output_file.getvalue()
+
+def decompress_files(blob, variable=False, key=None, text='none', logger:logging.Logger=None, cipher='random', preset:PresetDictionary=None)->dict[str, bytes]:
+    segments = read_segments(io.BytesIO(blob))
+    if len(segments) > 1:
+        files = dict()
+        for offset, size in segments:
+            files.update(decompress_files(blob[offset:offset+size], variable, key, text, logger, cipher, preset))
+        return files
+
+    reader = make_writer(io.BytesIO(blob), key, text, cipher)
+    options, names = read_header_options(reader.read_file_header())
+    lzw_processor, max_bits = options_processor(options, LZW_PROCESSORS[variable])
+    preset = options_preset(options, preset)
+    duplicates = options_duplicates(options)
+    unique_names = unique_members(names, duplicates)
+
+    # *blocks and -j members start with their CRC32
+    def decode(data, name)->bytes:
+        if 'crc' not in options:
+            return decompress_bytes(data, variable, key, text, logger, cipher, lzw_processor, max_bits, preset)
+        output = decompress_bytes(data[CRC_SIZE:], variable, key, text, logger, cipher, lzw_processor, max_bits, preset)
+        check_crc(name, zlib.crc32(output), read_crcs(data[:CRC_SIZE])[0])
+        return output
+
+    if 'block_size' in options:
+        reader.align_input()
+        members = [b''.join(decode(block, f'block {j} of {name}') for j, block in enumerate(read_blocks(reader))) for name in unique_names]
+    elif 'members' in options:
+        reader.align_input()
+        members = [decode(reader.read_bytes(int(size)), name) for size, name in zip(options['members'].split(','), unique_names)]
+    else:
+        members = decompress_stream(reader, variable, len(unique_names), logger, lzw_processor, max_bits, preset)
+        if 'crc' in options:
+            for name, member, crc in zip(unique_names, members, read_crcs(blob[-CRC_SIZE*len(members):])):
+                check_crc(name, zlib.crc32(member), crc)
+
+    members = iter(members)
+    outputs = []
+    for i in range(len(names)):
+        outputs.append(outputs[duplicates[i]] if i in duplicates else next(members))
+    return dict(zip(names, outputs))
+
+'''
+    *asyncio API
+    Compress or decompress a bare stream, like those of compress_bytes(), from an asyncio.StreamReader
+    to an asyncio.StreamWriter. Every chunk is fed to the session in the executor (the default one of the loop),
+    so that the event loop is never blocked, and the output is drained after every write for backpressure.
+    Return the number of bytes written.
+'''
+async def write_drained(writer:asyncio.StreamWriter, data:bytes)->int:
+    if data:
+        writer.write(data)
+        await writer.drain()
+    return len(data)
+
+async def compress_async(reader:asyncio.StreamReader, writer:asyncio.StreamWriter, variable=False, key=None, text='none', cipher='random', max_bits:int=None, executor=None)->int:
+    loop = asyncio.get_running_loop()
+    sink = StreamBuffer()
+    compressor = LZW_PROCESSORS[variable].COMPRESSOR(make_writer(sink, key, text, cipher), max_bits=max_bits)
+
+    size = 0
+    while chunk := await reader.read(CHUNK_SIZE):
+        await loop.run_in_executor(executor, compressor.feed, chunk)
+        size += await write_drained(writer, sink.read())
+    await loop.run_in_executor(executor, compressor.finish)
+    return size + await write_drained(writer, sink.read())
+
+async def decompress_async(reader:asyncio.StreamReader, writer:asyncio.StreamWriter, variable=False, key=None, text='none', cipher='random', max_bits:int=None, executor=None)->int:
+    loop = asyncio.get_running_loop()
+    source = StreamBuffer()
+    decompressor = LZW_PROCESSORS[variable].DECOMPRESSOR(make_writer(source, key, text, cipher), max_bits=max_bits)
+
+    def feed(chunk):
+        source.write(chunk)
+        decompressor.decode()
+        return decompressor.drain()
+
+    size = 0
+    while chunk := await reader.read(CHUNK_SIZE):
+        size += await write_drained(writer, await loop.run_in_executor(executor, feed, chunk))
+    return size + await write_drained(writer, await loop.run_in_executor(executor, decompressor.finish))
+
+'''
+    *Compress the input files into writer as one archive, or one segment of an appended archive
+'''
+def compress_archive(opt, writer:BaseLZWWriter, input_file_names, lzw_processor, preset, stats):
+    encryptor       = ENCRYPTORS[opt.cipher]
+    base_writer     = BASE_WRITERS[opt.text]
+
+    duplicates = find_duplicates(input_file_names) if opt.dedup else dict()
+    for i, j in duplicates.items():
+        print(f'{input_file_names[i]} is a copy of {input_file_names[j]} and is stored as a reference.')
+
+    '''
+        Add code to compress files
+    '''
+    if opt.block_size is not None:
+        compress_blocks(lzw_processor, writer, base_writer, encryptor, opt.encrypt, input_file_names, opt.block_size, opt.jobs, opt.bits, preset, duplicates, opt.crc)
+    elif opt.jobs is not None:
+        compress_parallel(lzw_processor, writer, base_writer, encryptor, opt.encrypt, input_file_names, opt.jobs, opt.mmap, opt.bits, preset, duplicates, opt.crc)
+    else:
+        options = {**processor_options(lzw_processor, opt.bits, preset), **duplicate_options(duplicates), **crc_options(opt.crc)}
+        writer.write_file_header(([write_header_options(options)] if options else []) + input_file_names)
+        crcs = lzw_processor.compress(writer, unique_members(input_file_names, duplicates), opt.mmap, stats, opt.bits, preset)
+        if opt.crc:
+            write_crc_trailer(writer, crcs)
+
+'''
+    *Decompress one archive, or one segment of an appended archive, from input_file
+'''
+def decompress_archive(opt, input_file, lzw_processor, preset, stdout):
+    encryptor       = ENCRYPTORS[opt.cipher]
+    base_writer     = BASE_WRITERS[opt.text]
+    # added lines:
+    reader = base_writer(input_file, code_size=CODE_SIZE) 
+    reader = encryptor(reader, encrypt_key=opt.encrypt)
+    options, output_file_names = read_header_options(reader.read_file_header())
+    lzw_processor, max_bits = options_processor(options, lzw_processor, opt.bits)
+    preset = options_preset(options, preset)
+
+    selected, matched = None, set()
+    if opt.extract is not None:
+        selected = [name in opt.extract or basename(name) in opt.extract for name in output_file_names]
+        matched = set(opt.extract) & {*output_file_names, *map(basename, output_file_names)}
+    
+    output_dir = opt.o
+    duplicates = options_duplicates(options)
+    if opt.test:
+        output_file_names = [DiscardFile(name) for name in output_file_names]
+    elif output_dir == STDIO_NAME:
+        if 'members' in options:
+            raise ValueError('Error: files compressed with -j cannot be written to stdout')
+        if duplicates:
+            raise ValueError('Error: archives with duplicate files cannot be written to stdout')
+        output_file_names = [stdout]*len(output_file_names)
+    else:
+        if not isdir(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+        for i, output_file_name in enumerate(output_file_names):
+            output_file_name = basename(output_file_name)
+            output_file_names[i] = join(output_dir, output_file_name)
+    output_file_names, selected, copies = plan_duplicates(output_file_names, selected, duplicates)
+    if opt.test:
+        copies = []
+    # *the CRC32s of a single stream end the archive
+    stream_crc = options.get('crc') == 'member' and 'members' not in options
+    input_file.keep_tail(CRC_SIZE*len(output_file_names) if stream_crc else 0)
+    checked = 'crc' in options
+
+    '''
+        Add code to decompress files
+    '''
+    lzw_dict = None
+    if opt.low_memory:
+        lzw_dict = ArrayLZWDict(2**(max_bits or lzw_processor.DECOMPRESSOR.MAX_BITS))
+    try:
+        if 'block_size' in options:
+            decompress_blocks(lzw_processor, reader, base_writer, encryptor, opt.encrypt, output_file_names, opt.jobs, lzw_dict, selected, max_bits, preset, options.get('crc') == 'block')
+        elif 'members' in options:
+            decompress_parallel(lzw_processor, reader, base_writer, encryptor, opt.encrypt, options, output_file_names, opt.jobs, lzw_dict, selected, opt.mmap, max_bits, preset)
+        else:
+            # a single stream has to be decoded up to the last selected file
+            if selected is not None:
+                output_file_names = [name if selected[i] else DiscardFile(file_name(name)) for i, name in enumerate(output_file_names)]
+            if stream_crc:
+                output_file_names = [CRCFile(name) for name in output_file_names]
+            lzw_processor.decompress(reader, output_file_names, lzw_dict, None, max_bits, preset)
+            if stream_crc:
+                checked = check_crc_trailer(input_file, output_file_names)
+        copy_duplicates(copies)
+    except ChecksumError:
+        raise
+    except Exception:
+        if opt.cipher == 'keystream':
+            print(f'Incorrect encryption key provided. Please also make sure that the same --cipher is used as in compression.')
+        else:
+            print(f'Incorrect encryption key provided. If you are certain that you used the correct key, \nplease also make sure that you are using the same python version, as the behavior of random.randint() may differ.')
+        if opt.test:
+            raise ValueError(f'Error: {input_file.name} failed the test') from None
+    else:
+        if opt.test and checked:
+            print(f'{input_file.name}: every file matches its CRC32.')
+        elif opt.test and 'crc' not in options:
+            print(f'{input_file.name}: decompressed without errors, but it has no checksums to check (compressed without --crc).')
+    return matched
+
+'''
+    *Report the names given to -x that match no file in any segment of the archive, and fail if none of them does
+'''
+def check_extracted(extract:list, matched:set):
+    if extract is None:
+        return
+    unmatched = [name for name in extract if name not in matched]
+    if len(unmatched) == len(extract):
+        raise ValueError(f'Error: no file in the archive matches {", ".join(unmatched)}')
+    for name in unmatched:
+        print(f'Warning: {name} matches no file in the archive.')
+
 def main():
     opt, print_usage = parse_args()
 
+    # *messages go to stderr when data is written to stdout
+    stdout = sys.stdout.buffer
+    if STDIO_NAME in (opt.c, opt.o):
+        sys.stdout = sys.stderr
+
     has_bin_to_text = opt.text != 'none'
     has_variable_code = 'variable' in opt
 
     print(f'Received encryption key: {opt.encrypt}.' if opt.encrypt else 'Received no encryption.')
     if has_bin_to_text:     print(f'Binary-to-text encoding {opt.text} is enabled.')
     if has_variable_code:   print('Variable-width code is enabled.')
+    if opt.clear:           print('CLEAR-code mode is enabled.')
+    if opt.variant != 'lzw':    print(f'LZW variant {opt.variant} is enabled.')
+    if opt.bits is not None:    print(f'Code size of {opt.bits} bits is enabled.')
+    if opt.bits is not None and opt.bits not in CODE_SIZES:
+        raise ValueError(f'Error: code size {opt.bits} is not between {CODE_SIZES[0]} and {CODE_SIZES[-1]}')
+
+    preset = None
+    if opt.preset is not None:
+        preset = PresetDictionary.load(opt.preset)
+        print(f'Preset dictionary {opt.preset} ({len(preset)} entries) is enabled.')
+        if opt.variant != 'lzw':
+            raise ValueError('Error: preset dictionaries cannot be used with LZMW or LZAP')
     
-    lzw_processor   = LZW_PROCESSORS[has_variable_code]
-    encryptor       = EncryptedLZWWriter
+    lzw_processor   = (CLEAR_CODE_PROCESSORS if opt.clear else LZW_PROCESSORS)[has_variable_code]
+    if opt.variant != 'lzw':
+        lzw_processor = VARIANT_PROCESSORS[opt.variant]
+    encryptor       = ENCRYPTORS[opt.cipher]
     base_writer     = BASE_WRITERS[opt.text]
 
-    if opt.c is not None and opt.input_files != []:
+    if opt.train is not None and opt.input_files != []:
+        samples = []
+        for input_file_name in opt.input_files:
+            with open_input_file(input_file_name) as input_file:
+                samples.append(input_file.read())
+        preset = PresetDictionary.train(samples, opt.preset_size)
+        os.makedirs(dirname(opt.train) or '.', exist_ok=True)
+        preset.save(opt.train)
+        print(f'Trained a preset dictionary of {len(preset)} entries on {len(samples)} files into {opt.train}.')
+
+    elif (opt.c is not None or opt.a is not None) and opt.input_files != []:
         input_file_names = opt.input_files
-        output_file_name = opt.c
+        output_file_name = opt.c if opt.c is not None else opt.a
 
-        # added line:
-        os.makedirs(dirname(output_file_name), exist_ok=True)
+        for input_file_name in input_file_names:
+            if input_file_name == STDIO_NAME and (opt.block_size is not None or opt.jobs is not None):
+                raise ValueError('Error: stdin cannot be compressed with -b or -j')
+            if input_file_name != STDIO_NAME and not isfile(input_file_name):
+                raise ValueError(f'Error: file {input_file_name} does not exist')
 
-        output_file = open(output_file_name, 'wb')
+        segments = None
+        if opt.a is not None:
+            if output_file_name == STDIO_NAME:
+                raise ValueError('Error: files cannot be appended to stdout')
+            output_file, segments, trailer = open_append(output_file_name)
+            offset = output_file.tell()
+            if segments:
+                print(f'Appending segment {len(segments)+1} to {output_file_name} at offset {offset}.')
+        elif output_file_name == STDIO_NAME:
+            output_file = stdout
+        else:
+            # added line:
+            os.makedirs(dirname(output_file_name), exist_ok=True)
+            output_file = open(output_file_name, 'wb')
+
+        stats = None
+        if opt.stats is not None:
+            if opt.block_size is not None or opt.jobs is not None:
+                raise ValueError('Error: --stats cannot be used with -b or -j')
+            stats = LZWStats()
         # added lines:
-        writer = base_writer(output_file, code_size=CODE_SIZE) 
+        writer = base_writer(output_file if stats is None else stats.wrap_output(output_file), code_size=CODE_SIZE) 
         writer = encryptor(writer, encrypt_key=opt.encrypt)
 
-        for input_file_name in input_file_names:
-            if not isfile(input_file_name):
-                raise ValueError(f'Error: file {input_file_name} does not exist')
-        writer.write_file_header(input_file_names)
-
-        '''
-            Add code to compress files
-        '''
-        lzw_processor.compress(writer, input_file_names)
+        if opt.a is None:
+            compress_archive(opt, writer, input_file_names, lzw_processor, preset, stats)
+        else:
+            # *the index is only rewritten once the whole segment is written, and a failed append is undone
+            try:
+                compress_archive(opt, writer, input_file_names, lzw_processor, preset, stats)
+                if segments:
+                    write_segments(output_file, segments + [(offset, output_file.tell() - offset)])
+                    output_file.truncate()
+            except BaseException:
+                restore_append(output_file, output_file_name, offset, trailer)
+                raise
+        output_file.close()
+
+        if stats is not None:
+            if opt.stats == STDIO_NAME:
+                print(json.dumps(stats.to_dict(), indent=2))
+            else:
+                with open(opt.stats, 'w') as stats_file:
+                    json.dump(stats.to_dict(), stats_file, indent=2)
 
     elif opt.d is not None and opt.input_files == []:
         input_file_name = opt.d
-        input_file = open(input_file_name, 'rb')
-        # added lines:
-        reader = base_writer(input_file, code_size=CODE_SIZE) 
-        reader = encryptor(reader, encrypt_key=opt.encrypt)
-        output_file_names = reader.read_file_header()
-        
-        output_dir = opt.o
-        if not isdir(output_dir):
-            os.makedirs(output_dir, exist_ok=True)
-        for i, output_file_name in enumerate(output_file_names):
-            output_file_name = basename(output_file_name)
-            output_file_names[i] = join(output_dir, output_file_name)
-
-        '''
-            Add code to decompress files
-        '''
-        try:
-            lzw_processor.decompress(reader, output_file_names)
-        except Exception:
-            print(f'Incorrect encryption key provided. If you are certain that you used the correct key, \nplease also make sure that you are using the same python version, as the behavior of random.randint() may differ.')
+        if input_file_name == STDIO_NAME:
+            input_file = TailFile(sys.stdin.buffer)
+            matched = decompress_archive(opt, input_file, lzw_processor, preset, stdout)
+            if input_file.has_segments():
+                print('Warning: the archive has appended segments, which are only read when it is decompressed from a file.')
+        else:
+            with open(input_file_name, 'rb') as input_file:
+                segments = read_segments(input_file)
+            matched = set()
+            for offset, size in segments:
+                with open(input_file_name, 'rb') as input_file:
+                    matched |= decompress_archive(opt, SegmentFile(input_file, offset, size), lzw_processor, preset, stdout)
+        check_extracted(opt.extract, matched)
 
     else:
         print_usage()
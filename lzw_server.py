@@ -0,0 +1,182 @@
+import json
+import signal
+import multiprocessing
+import socket
+from lzw_client import FRAME_PREFIX_SIZE, DEFAULT_SOCKET
+from lzw_enhancements import *
+
+'''
+    *Compression daemon
+    Serve compress and decompress requests of lzw_client.py over a Unix domain socket, so that many small jobs
+    do not each pay for interpreter startup and imports. Connections are handled by an asyncio server and the work
+    is dispatched to a pool of worker processes, started and warmed up before the socket is opened.
+    See lzw_client.py for the protocol.
+'''
+
+MAX_FRAME_SIZE = 2**30 # *bytes buffered for one frame of a request
+
+'''
+    Parse command line arguments
+'''
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run a local LZW compression daemon serving lzw_client.py')
+    parser.add_argument('--socket', type=str, default=DEFAULT_SOCKET, help=f'Unix domain socket to listen on (Default: {DEFAULT_SOCKET})')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Number of worker processes (Default: number of CPUs)')
+    parser.add_argument('--max-frame', dest='max_frame', type=int, default=MAX_FRAME_SIZE, help=f'Largest frame accepted from a client, in bytes (Default: {MAX_FRAME_SIZE})')
+    return parser.parse_args()
+
+'''
+    *Read one frame, refusing a length prefix that is not hex or is larger than max_size
+'''
+async def read_frame(reader:asyncio.StreamReader, max_size:int=MAX_FRAME_SIZE)->bytes:
+    prefix = await reader.readexactly(FRAME_PREFIX_SIZE)
+    if not all(digit in b'0123456789abcdefABCDEF' for digit in prefix):
+        raise ValueError(f'Error: invalid frame length prefix {prefix!r}')
+    size = int(prefix, 16)
+    if size > max_size:
+        raise ValueError(f'Error: a frame of {size} bytes is larger than the limit of {max_size} bytes')
+    return await reader.readexactly(size)
+
+async def write_frame(writer:asyncio.StreamWriter, data:bytes):
+    await write_drained(writer, f'{len(data):0{FRAME_PREFIX_SIZE}x}'.encode() + data)
+
+'''
+    *Jobs run in the worker processes
+'''
+WARM_UP_TIMEOUT = 60 # seconds for every worker to start
+
+def init_worker(barrier):
+    # *the daemon stops its workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    global warm_up_barrier
+    warm_up_barrier = barrier
+
+def warm_up()->int:
+    compress_bytes(b'warm up')
+    # *a worker waits for all the others, so that each one runs a warm-up task of its own
+    warm_up_barrier.wait(WARM_UP_TIMEOUT)
+    return os.getpid()
+
+def compress_job(names:list, members:list, options:dict)->bytes:
+    return compress_files(dict(zip(names, members)), **options)
+
+def decompress_job(blob:bytes, options:dict)->dict[str, bytes]:
+    return decompress_files(blob, **options)
+
+def request_options(request:dict)->dict:
+    options = {'variable': bool(request.get('variable')), 'key': request.get('key'), 'text': request.get('text', 'none'), 'cipher': request.get('cipher', 'random')}
+    if options['text'] not in BASE_WRITERS:
+        raise ValueError(f'Error: unknown binary-to-text encoding {options["text"]}')
+    if options['cipher'] not in ENCRYPTORS:
+        raise ValueError(f'Error: unknown cipher {options["cipher"]}')
+    if options['key'] is not None and not isinstance(options['key'], int):
+        raise ValueError('Error: the encryption key must be an integer')
+    return options
+
+'''
+    *The names decide how many frames follow the request, so its shape is checked before they are read
+'''
+def request_names(request)->list:
+    if not isinstance(request, dict):
+        raise TypeError('Error: the request must be a JSON object')
+    names = request.get('names', [])
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        raise TypeError('Error: the names of the request must be a list of strings')
+    return names
+
+def error_response(error:Exception)->list[bytes]:
+    return [json.dumps({'ok': False, 'type': type(error).__name__, 'error': str(error)}).encode()]
+
+async def run_request(executor:ProcessPoolExecutor, request:dict, names:list, frames:list)->list[bytes]:
+    loop = asyncio.get_running_loop()
+    try:
+        options = request_options(request)
+        if request.get('op') == 'compress':
+            if len(set(names)) < len(names):
+                raise ValueError('Error: compressed files need distinct names')
+            max_bits = request.get('max_bits')
+            if max_bits is not None and max_bits not in CODE_SIZES:
+                raise ValueError(f'Error: code size {max_bits} is not between {CODE_SIZES[0]} and {CODE_SIZES[-1]}')
+            outputs = {None: await loop.run_in_executor(executor, compress_job, names, frames, {**options, 'max_bits': max_bits})}
+        elif request.get('op') == 'decompress':
+            outputs = await loop.run_in_executor(executor, decompress_job, frames[0], options)
+        else:
+            raise ValueError(f'Error: unknown operation {request.get("op")}')
+        return [json.dumps({'ok': True, 'names': list(outputs)}).encode(), *outputs.values()]
+    except Exception as error:
+        return error_response(error)
+
+'''
+    *Handle one connection: read the request, run it in the pool and stream the response frames
+'''
+async def handle(reader:asyncio.StreamReader, writer:asyncio.StreamWriter, executor:ProcessPoolExecutor, max_frame:int=MAX_FRAME_SIZE):
+    try:
+        # the whole request is read before it is checked, so that the client is never cut off while sending
+        request = json.loads(await read_frame(reader, max_frame))
+        names = request_names(request)
+        frames = [await read_frame(reader, max_frame) for _ in (names if request.get('op') == 'compress' else [None])]
+    except asyncio.IncompleteReadError:
+        # the client went away in the middle of the request
+        writer.close()
+        return
+    except (ValueError, TypeError) as error:
+        # the rest of a request with a bad frame, invalid JSON or the wrong shape cannot be read,
+        # so it is answered without reading it
+        response = error_response(error)
+    else:
+        response = await run_request(executor, request, names, frames)
+
+    try:
+        for data in response:
+            await write_frame(writer, data)
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+'''
+    *Refuse to replace the socket of a running daemon, but remove a stale one
+'''
+def remove_stale_socket(socket_path):
+    if not exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except ConnectionRefusedError:
+            os.remove(socket_path)
+            return
+    raise ValueError(f'Error: a daemon is already listening on {socket_path}')
+
+async def serve(socket_path, jobs, max_frame=MAX_FRAME_SIZE):
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(multiprocessing.Barrier(jobs),)) as executor:
+        pids = await asyncio.gather(*(loop.run_in_executor(executor, warm_up) for _ in range(jobs)))
+        server = await asyncio.start_unix_server(lambda reader, writer: handle(reader, writer, executor, max_frame), path=socket_path)
+        print(f'Listening on {socket_path} with {len(set(pids))} worker processes.', flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+def main():
+    opt = parse_args()
+    if not hasattr(socket, 'AF_UNIX'):
+        raise ValueError('Error: Unix domain sockets are not supported on this platform')
+    if opt.jobs < 1:
+        raise ValueError('Error: at least one worker process is needed')
+    if opt.max_frame < 0:
+        raise ValueError('Error: the frame size limit cannot be negative')
+
+    remove_stale_socket(opt.socket)
+    # *SIGTERM stops the daemon like Ctrl-C, removing the socket
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(serve(opt.socket, opt.jobs, opt.max_frame))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,437 @@
+import socket
+import subprocess
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+import lzw
+from lzw_enhancements import *
+
+'''
+    Bit I/O
+'''
+@pytest.mark.skipif(lzw.np is None, reason='numpy is not installed')
+@pytest.mark.parametrize('text', ['none', 'hex', 'base64'])
+def test_bulk_codes_match_single_codes(monkeypatch, text):
+    rng = random.Random(0)
+    # runs of odd lengths start in the middle of a unit, and the long ones cross CHUNK_SIZE
+    runs = [(code_size, [rng.randrange(2**code_size) for _ in range(n)]) for code_size in CODE_SIZES for n in (1, 7, 5000)]
+    def write()->bytes:
+        output = io.BytesIO()
+        writer = BASE_WRITERS[text](output)
+        for code_size, codes in runs:
+            writer.set_code_size(code_size)
+            writer.write_codes(codes)
+        writer.flush()
+        return output.getvalue()
+    def read(blob)->list:
+        reader = BASE_WRITERS[text](io.BytesIO(blob))
+        read_runs = []
+        for code_size, codes in runs:
+            reader.set_code_size(code_size)
+            read_runs.append((code_size, [int(code) for code in reader.read_codes(len(codes))]))
+        return read_runs
+
+    blob = write()
+    assert read(blob) == runs
+    # without numpy, codes are packed one at a time by write_code and read_code
+    monkeypatch.setattr(lzw, 'np', None)
+    assert write() == blob
+    assert read(blob) == runs
+
+@pytest.mark.parametrize('text', ['none', 'hex', 'base64'])
+def test_flush_writes_last_code_whole(text):
+    for code_size in CODE_SIZES:
+        for n in range(1, 4):
+            output = io.BytesIO()
+            writer = BASE_WRITERS[text](output, code_size)
+            for _ in range(n):
+                writer.write_code(2**code_size-1)
+            writer.flush()
+            reader = BASE_WRITERS[text](io.BytesIO(output.getvalue()), code_size)
+            assert [reader.read_code() for _ in range(n)] == [2**code_size-1]*n, (code_size, n)
+
+'''
+    Compression dictionaries
+'''
+class CodeList(BaseLZWWriter):
+    # the codes a compressor writes
+    def __init__(self):
+        self.codes = []
+
+    def write_code(self, code):
+        self.codes.append(code)
+
+def reference_codes(data, bits)->list:
+    # LZW over a dict of byte strings, as the skeleton does it, reset when full
+    DICT = {bytes([v]): v for v in range(256)}
+    codes, STRING = [], data[:1]
+    for CHAR in data[1:]:
+        if STRING + bytes([CHAR]) in DICT:
+            STRING += bytes([CHAR])
+            continue
+        codes.append(DICT[STRING])
+        if len(DICT) >= 2**bits-1:
+            DICT = {bytes([v]): v for v in range(256)}
+        else:
+            DICT[STRING + bytes([CHAR])] = len(DICT)
+        STRING = bytes([CHAR])
+    return codes + [DICT[STRING], 2**bits-1, 2**bits-1]
+
+# 12-bit dictionaries fill up and are reset; 20-bit ones are stored in an LZWEncodeTable, which is doubled as it fills
+@pytest.mark.parametrize('bits', [12, 20])
+def test_prefix_dict_matches_byte_strings(bits):
+    rng = random.Random(bits)
+    data = b''.join(rng.choice([b'alpha ', b'beta ', b'gamma\n', rng.randbytes(3)]) for _ in range(20000))
+    writer = CodeList()
+    compressor = LZWCompressor(writer, max_bits=bits)
+    for start in range(0, len(data), 1000):
+        compressor.feed(data[start:start+1000])
+    compressor.end_member()
+    compressor.finish()
+    assert writer.codes == reference_codes(data, bits)
+    assert decompress_bytes(compress_bytes(data, max_bits=bits), max_bits=bits) == data
+
+'''
+    Encryption
+'''
+@pytest.mark.parametrize('text', ['none', 'hex', 'base64'])
+def test_keystream_header_any_key(text):
+    files = {f'dir/file_number_{i}_é.txt': f'content {i}\n'.encode() for i in range(30)}
+    for key in range(1, 41):
+        blob = compress_files(files, key=key, text=text, cipher='keystream', crc=True)
+        assert decompress_files(blob, key=key, text=text, cipher='keystream') == files, key
+
+@pytest.mark.parametrize('text', ['none', 'hex', 'base64'])
+def test_random_cipher_header_surrogates(text):
+    # with this key the options line is shifted to a surrogate, which UTF-8 only encodes with surrogatepass
+    files = {f'dir/name_{i}.txt': b'abc'*i for i in range(3)}
+    blob = compress_files(files, key=17, text=text, crc=True)
+    assert decompress_files(blob, key=17, text=text) == files
+
+'''
+    Concurrent sessions
+'''
+@pytest.mark.parametrize('cipher', ['random', 'keystream'])
+def test_threads_match_serial(cipher):
+    words = [b'alpha ', b'beta ', b'gamma ', b'delta\n']
+    cases = [(b''.join(random.Random(i).choices(words, k=20000)), text, i + 1) for i, text in enumerate(['none', 'hex', 'base64']*3)]
+    def session(case):
+        data, text, key = case
+        blob = compress_bytes(data, key=key, text=text, cipher=cipher)
+        return blob, decompress_bytes(blob, key=key, text=text, cipher=cipher)
+
+    serial = [session(case) for case in cases]
+    assert [data for _, data in serial] == [data for data, _, _ in cases]
+    with ThreadPoolExecutor(max_workers=len(cases)) as executor:
+        assert list(executor.map(session, cases)) == serial
+
+class BufferWriter:
+    # what an asyncio.StreamWriter would send
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+def stream_reader(data):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+def test_async_streams_round_trip():
+    cases = [(random.Random(i).randbytes(1000)*100, text, key) for i, (text, key) in enumerate([('none', None), ('hex', 5), ('base64', 6), ('none', 7)])]
+    async def round_trip(data, text, key):
+        blob, output = BufferWriter(), BufferWriter()
+        assert await compress_async(stream_reader(data), blob, key=key, text=text) == len(blob.data)
+        assert await decompress_async(stream_reader(bytes(blob.data)), output, key=key, text=text) == len(data)
+        return bytes(blob.data), bytes(output.data)
+
+    async def gather():
+        return await asyncio.gather(*(round_trip(*case) for case in cases))
+    for (data, text, key), (blob, output) in zip(cases, asyncio.run(gather())):
+        assert blob == compress_bytes(data, key=key, text=text)
+        assert decompress_bytes(blob, key=key, text=text) == output == data
+
+'''
+    Variable-width code
+'''
+def test_variable_width_reset_after_new_entry():
+    # the dictionary fills up on the long run, whose codes refer to the entry added just before them, the code at the reset too
+    data = random.Random(0).randbytes(89000).replace(b'\xff', b'\0') + b'\xff'*100000
+    assert decompress_bytes(compress_bytes(data, True), True) == data
+
+'''
+    Command line
+'''
+SCRIPT = join(dirname(os.path.abspath(__file__)), 'lzw_enhancements.py')
+
+def run(*args, **kwargs):
+    return subprocess.run([sys.executable, SCRIPT, *map(str, args)], capture_output=True, text=True, check=True, **kwargs).stdout
+
+@pytest.mark.parametrize('option', [['-j', 0], ['-b', 0], ['-b', -5]])
+def test_rejects_counts_below_one(tmp_path, option):
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run('-c', tmp_path / 'a.lzw', SCRIPT, *option)
+    assert 'must be at least 1' in error.value.stderr
+    assert not (tmp_path / 'a.lzw').exists()
+
+@pytest.mark.parametrize('mode', [[], ['-j', 2], ['-b', 1000]])
+def test_extract_by_basename(tmp_path, mode):
+    files = {'a.txt': b'first file\n'*300, 'b.txt': b'second file\n'*300}
+    for name, data in files.items():
+        (tmp_path / 'in' / name[0]).mkdir(parents=True)
+        (tmp_path / 'in' / name[0] / name).write_bytes(data)
+    run('-c', tmp_path / 'a.lzw', *(tmp_path / 'in' / name[0] / name for name in files), *mode)
+    output = run('-d', tmp_path / 'a.lzw', '-o', tmp_path / 'out', '-x', 'b.txt', 'c.txt')
+    assert 'c.txt matches no file' in output
+    assert [path.name for path in (tmp_path / 'out').iterdir()] == ['b.txt']
+    assert (tmp_path / 'out' / 'b.txt').read_bytes() == files['b.txt']
+
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run('-d', tmp_path / 'a.lzw', '-o', tmp_path / 'out', '-x', 'c.txt')
+    assert 'no file in the archive matches c.txt' in error.value.stderr
+
+@pytest.mark.parametrize('option, message', [('version=3', 'unsupported archive version 3'), ('future=1', 'unsupported archive option future')])
+def test_later_archives_are_refused(tmp_path, option, message):
+    blob = compress_files({'a.txt': b'abc'*10}, crc=True)
+    assert decompress_files(blob.replace(b'crc=member', b'crc=member;version=2')) == {'a.txt': b'abc'*10}
+    blob = blob.replace(b'crc=member', b'crc=member;' + option.encode())
+    with pytest.raises(ValueError, match=message):
+        decompress_files(blob)
+    (tmp_path / 'a.lzw').write_bytes(blob)
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run('-d', tmp_path / 'a.lzw', '-o', tmp_path / 'out')
+    assert message in error.value.stderr
+
+@pytest.mark.parametrize('mode', [['--test'], ['-o', 'out']])
+def test_corrupted_block_is_named(tmp_path, mode):
+    (tmp_path / 'w.txt').write_bytes(b'hello world '*1000)
+    run('-c', tmp_path / 'a.lzw', tmp_path / 'w.txt', '-b', 4000, '--crc')
+    archive = bytearray((tmp_path / 'a.lzw').read_bytes())
+    # the CRC32 of block 1 follows the size prefix of block 1, after block 0 and its own prefix
+    start = archive.index(b'\n\n') + 2
+    crc = start + BLOCK_PREFIX_SIZE + int(archive[start:start + BLOCK_PREFIX_SIZE], 16) + BLOCK_PREFIX_SIZE
+    archive[crc] = ord('1') if archive[crc] == ord('0') else ord('0')
+    (tmp_path / 'a.lzw').write_bytes(archive)
+
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run('-d', tmp_path / 'a.lzw', *mode, cwd=tmp_path)
+    assert 'block 1 of ' in error.value.stderr and 'w.txt is corrupted' in error.value.stderr
+    with pytest.raises(ChecksumError, match=f'block 1 of {tmp_path / "w.txt"} is corrupted'):
+        decompress_files(bytes(archive))
+
+'''
+    Binary-to-text encoding
+'''
+class TrickleFile:
+    # a pipe that delivers a few bytes at a time, odd counts included
+    def __init__(self, data, step=5):
+        self.file, self.step = io.BytesIO(data), step
+
+    def read(self, n=-1):
+        return self.file.read(self.step if n < 0 else min(n, self.step))
+
+def test_hex_archive_is_hex_of_binary():
+    files = {'a.txt': b'first file\n'*300, 'b.bin': random.Random(0).randbytes(5000)}
+    # raw bytes, like the CRC32 trailer, are hex digits already, so only the codes and the header are compared
+    assert compress_files(files, text='hex') == binascii.hexlify(compress_files(files))
+    data = b'hex digits arrive in odd counts\n'*3000
+    assert decompress_stream(make_writer(TrickleFile(compress_bytes(data, text='hex')), text='hex'), False, 1) == [data]
+
+@pytest.mark.parametrize('mode', [['-j', 2], ['-b', 1000]])
+def test_hex_members_skipped(tmp_path, mode):
+    files = {'a.txt': b'first file\n'*300, 'b.txt': b'second file\n'*300}
+    for name, data in files.items():
+        (tmp_path / name).write_bytes(data)
+    run('-c', tmp_path / 'a.lzw', *(tmp_path / name for name in files), '-t', 'hex', '--crc', *mode)
+    run('-d', tmp_path / 'a.lzw', '-o', tmp_path / 'out', '-t', 'hex', '-x', 'b.txt')
+    assert [path.name for path in (tmp_path / 'out').iterdir()] == ['b.txt']
+    assert (tmp_path / 'out' / 'b.txt').read_bytes() == files['b.txt']
+
+# names of every length modulo 3, so that the header ends at every bit of a base64 character
+@pytest.mark.parametrize('name', ['a', 'ab', 'abc'])
+@pytest.mark.parametrize('variable', [False, True])
+def test_base64_archive_is_bits_of_binary(name, variable):
+    files = {name: b'six bits at a time\n'*500, 'random.bin': random.Random(1).randbytes(3000)}
+    binary = compress_files(files, variable)
+    archive = compress_files(files, variable, text='base64')
+    assert set(archive) <= set(Base64LZWWriter.std_base64chars.encode('ascii'))
+    bits = ''.join(f'{unit:06b}' for unit in archive.translate(Base64LZWWriter.DECODE_TABLE))
+    assert bits.rstrip('0') == ''.join(f'{byte:08b}' for byte in binary).rstrip('0')
+    assert decompress_files(archive, variable, text='base64') == files
+    reader = make_writer(TrickleFile(archive), text='base64')
+    names = read_header_options(reader.read_file_header())[1]
+    assert dict(zip(names, decompress_stream(reader, variable, len(names)))) == files
+
+'''
+    CLEAR-code mode
+'''
+@pytest.mark.parametrize('variable', [[], ['-v']])
+def test_clear_recorded_in_header(tmp_path, variable):
+    data = (b'the quick brown fox jumps over the lazy dog\n'*2000) + bytes(random.Random(1).randbytes(50000))
+    (tmp_path / 'data.bin').write_bytes(data)
+    # a small dictionary, so that it fills up and CLEAR codes are written
+    run('-c', tmp_path / 'a.lzw', tmp_path / 'data.bin', '--clear', '--bits', 10, *variable)
+    run('-d', tmp_path / 'a.lzw', '-o', tmp_path / 'out', *variable)
+    assert (tmp_path / 'out' / 'data.bin').read_bytes() == data
+
+'''
+    LZMW and LZAP
+'''
+@pytest.mark.parametrize('mode', ['-v', '--clear'])
+def test_variant_rejects_other_modes(tmp_path, mode):
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run('-c', tmp_path / 'a.lzw', SCRIPT, '--variant', 'lzmw', mode)
+    assert 'cannot be combined' in error.value.stderr
+    assert not (tmp_path / 'a.lzw').exists()
+
+'''
+    Code size
+'''
+@pytest.mark.skipif(not hasattr(os, 'wait4'), reason='os.wait4 is not supported')
+@pytest.mark.parametrize('mode', [[], ['-b', 1000]])
+def test_wide_codes_decode_in_little_memory(tmp_path, mode):
+    data = b'a small file, in blocks or not\n'*100
+    (tmp_path / 'small.txt').write_bytes(data)
+    run('-c', tmp_path / 'a.lzw', tmp_path / 'small.txt', '--bits', 24, *mode)
+    # the decoding tables grow with the data, instead of being sized for all 2**24 codes
+    process = subprocess.Popen([sys.executable, SCRIPT, '-d', tmp_path / 'a.lzw', '-o', tmp_path / 'out'], stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    assert status == 0
+    assert usage.ru_maxrss < 100*2**10 # KB on Linux, bytes on macOS
+    assert (tmp_path / 'out' / 'small.txt').read_bytes() == data
+
+'''
+    Preset dictionaries
+'''
+def log_lines(seed, n=20)->bytes:
+    rng = random.Random(seed)
+    return b''.join(b'%s GET /api/v1/%s?id=%d HTTP/1.1 200\n' % (rng.choice([b'INFO', b'WARN']), rng.choice([b'users', b'orders', b'items']), rng.randrange(1000)) for _ in range(n))
+
+def test_preset_required_to_decompress(tmp_path):
+    for i in range(5):
+        (tmp_path / f'sample{i}.log').write_bytes(log_lines(i))
+    run('--train', tmp_path / 'preset.lzwp', *(tmp_path / f'sample{i}.log' for i in range(5)), '--preset-size', 256)
+    preset = PresetDictionary.load(tmp_path / 'preset.lzwp')
+    assert len(preset) <= 256 and PresetDictionary.from_bytes(preset.to_bytes()).digest == preset.digest
+
+    (tmp_path / 'small.log').write_bytes(log_lines(10))
+    run('-c', tmp_path / 'plain.lzw', tmp_path / 'small.log')
+    run('-c', tmp_path / 'a.lzw', tmp_path / 'small.log', '--preset', tmp_path / 'preset.lzwp')
+    assert (tmp_path / 'a.lzw').stat().st_size < (tmp_path / 'plain.lzw').stat().st_size
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        run('-d', tmp_path / 'a.lzw', '-o', tmp_path / 'out')
+    assert 'has to be given with --preset' in error.value.stderr
+    run('-d', tmp_path / 'a.lzw', '-o', tmp_path / 'out', '--preset', tmp_path / 'preset.lzwp')
+    assert (tmp_path / 'out' / 'small.log').read_bytes() == log_lines(10)
+
+    # another preset is refused, in memory too, with variable-width code as well as fixed-width code
+    other = PresetDictionary.train([log_lines(20)], 16)
+    for variable in (False, True):
+        blob = compress_files({'small.log': log_lines(10)}, variable, preset=preset)
+        assert decompress_files(blob, variable, preset=preset) == {'small.log': log_lines(10)}
+        with pytest.raises(ValueError, match=f'not {other.digest}'):
+            decompress_files(blob, variable, preset=other)
+
+'''
+    Deduplication
+'''
+@pytest.mark.parametrize('mode', [[], ['-j', 2], ['-b', 1000]])
+def test_duplicates_stored_once(tmp_path, mode):
+    files = {'a.txt': b'first file\n'*300, 'b.txt': random.Random(0).randbytes(3000), 'c.txt': b'first file\n'*300}
+    for name, data in files.items():
+        (tmp_path / name).write_bytes(data)
+    run('-c', tmp_path / 'dedup.lzw', *(tmp_path / name for name in files), '--crc', *mode)
+    run('-c', tmp_path / 'unique.lzw', tmp_path / 'a.txt', tmp_path / 'b.txt', '--crc', *mode)
+    run('-c', tmp_path / 'copies.lzw', *(tmp_path / name for name in files), '--crc', '--no-dedup', *mode)
+    # the copy costs its name and a reference in the header, not its data
+    dedup_size = (tmp_path / 'dedup.lzw').stat().st_size
+    assert dedup_size < (tmp_path / 'unique.lzw').stat().st_size + 100 < (tmp_path / 'copies.lzw').stat().st_size
+    for archive in ('dedup', 'copies'):
+        run('-d', tmp_path / f'{archive}.lzw', '-o', tmp_path / archive)
+        assert {path.name: path.read_bytes() for path in (tmp_path / archive).iterdir()} == files
+    # a copy is extracted without its original
+    run('-d', tmp_path / 'dedup.lzw', '-o', tmp_path / 'copy', '-x', 'c.txt')
+    assert [path.name for path in (tmp_path / 'copy').iterdir()] == ['c.txt']
+    assert (tmp_path / 'copy' / 'c.txt').read_bytes() == files['c.txt']
+
+def test_duplicates_in_memory():
+    files = {'a.txt': b'same\n'*100, 'b.txt': b'other\n'*100, 'c.txt': b'same\n'*100, 'd.txt': b''}
+    blob = compress_files(files, crc=True)
+    assert len(blob) < len(compress_files(files, dedup=False, crc=True))
+    assert decompress_files(blob) == decompress_files(compress_files(files, dedup=False)) == files
+
+'''
+    Compression daemon
+'''
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='Unix domain sockets are not supported')
+def test_daemon_workers_and_errors(tmp_path):
+    import lzw_client
+    socket_path = str(tmp_path / 'lzw.sock')
+    server = subprocess.Popen([sys.executable, join(dirname(SCRIPT), 'lzw_server.py'), '--socket', socket_path, '-j', '2', '--max-frame', str(2**16)], stdout=subprocess.PIPE, text=True)
+    try:
+        assert 'with 2 worker processes' in server.stdout.readline()
+        files = {'a.txt': b'abc'*1000, 'b.txt': b'xyz'*1000}
+        blob = bytearray(compress_files(files, crc=True))
+        assert lzw_client.decompress_files(bytes(blob), socket_path=socket_path) == files
+        blob[-1] = ord('0') if blob[-1] != ord('0') else ord('1') # a hex digit of the trailer of CRC32s
+        with pytest.raises(lzw_client.DaemonError) as error:
+            lzw_client.decompress_files(bytes(blob), socket_path=socket_path)
+        assert error.value.type == 'ChecksumError'
+        # requests of the wrong shape are answered with an error instead of a closed connection
+        for names in (5, 'a.txt', [1]):
+            with pytest.raises(lzw_client.DaemonError) as error:
+                list(lzw_client.request('compress', names, [], socket_path=socket_path))
+            assert error.value.type == 'TypeError'
+        # so are requests that cannot be read: a bad length prefix, a frame over the limit and invalid JSON
+        for frame, message in ((b'zzzzzzzz', 'invalid frame length prefix'), (b'%08x' % (2**16+1), 'larger than the limit'), (b'00000003{x}', 'Expecting')):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(socket_path)
+                sock.sendall(frame)
+                with sock.makefile('rb') as response:
+                    status = json.loads(lzw_client.read_frame(response))
+            assert not status['ok'] and message in status['error']
+    finally:
+        server.terminate()
+        server.wait()
+
+'''
+    Append mode
+'''
+@pytest.mark.parametrize('text', ['none', 'hex'])
+@pytest.mark.parametrize('segments', [1, 2])
+def test_failed_append_keeps_segments(tmp_path, monkeypatch, segments, text):
+    archive = tmp_path / 'a.lzw'
+    files = {}
+    for i in range(segments):
+        path = tmp_path / f'f{i}.txt'
+        path.write_bytes(f'segment {i} '.encode()*500)
+        files[path.name] = path.read_bytes()
+        run('-a', archive, path, '-t', text)
+    original = archive.read_bytes()
+
+    def failing_compress(cls, writer, *args):
+        writer.write_bytes(b'0'*100000) # part of a segment reaches the file before the failure
+        writer.flush()
+        raise KeyboardInterrupt
+    monkeypatch.setattr(LZWProcessor, 'compress', classmethod(failing_compress))
+    monkeypatch.setattr(sys, 'argv', [SCRIPT, '-a', str(archive), SCRIPT, '-t', text])
+    with pytest.raises(KeyboardInterrupt):
+        main()
+
+    assert archive.read_bytes() == original
+    run('-d', archive, '-o', tmp_path / 'out', '-t', text)
+    assert {name: (tmp_path / 'out' / name).read_bytes() for name in files} == files
+    # from stdin only the first segment is read, and the trailer must not reach the reader
+    with archive.open('rb') as stdin:
+        assert 'decompressed without errors' in run('-d', '-', '--test', '-t', text, stdin=stdin)
+
+def test_failed_append_removes_created_archive(tmp_path, monkeypatch):
+    monkeypatch.setattr(LZWProcessor, 'compress', classmethod(lambda cls, *args: 1/0))
+    monkeypatch.setattr(sys, 'argv', [SCRIPT, '-a', str(tmp_path / 'new.lzw'), SCRIPT])
+    with pytest.raises(ZeroDivisionError):
+        main()
+    assert not (tmp_path / 'new.lzw').exists()